@@ -1,25 +1,26 @@
 import fastapi
-from fastapi import Request, HTTPException, Depends
+from fastapi import Request, Response, HTTPException, Depends, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from utils.files import JSON
-from jwtconfig import create_access_token, decode_access_token
-from utils.database import MySQL
-from utils.security import InputValidator, IP
-from utils.easify import GetMSG, Now
-import hashlib
+from jwtconfig import create_access_token, decode_access_token, verified_tokens
+from utils.audit import AuditLog
+from utils.cache import CatalogCache
+from utils.catalog import EventCalendar, VisibleTowns
+from utils.database import AsyncMySQL, MySQL
+from utils.security import InputValidator, IP, PasswordHasher
+from utils.easify import Cursor, GetMSG, Now, SQLWhere
+from utils.mail import Mailer
+from utils.search import CatalogSearch
+import asyncio
+import csv
+import io
 import json
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import zlib
+from typing import Optional
 
 AuthRouter = fastapi.APIRouter()
 security = HTTPBearer()
 
-smtp_server = "smtp.sendgrid.net"
-smtp_port = 587 
-smtp_username = "apikey"
-Config: dict = JSON.Read("config.json")
-smtp_password = Config["keys"]["SENDGRID_API_KEY"]
 
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
 	token = credentials.credentials
@@ -28,18 +29,32 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 		raise HTTPException(status_code=401, detail="Token inválido o expirado")
 	return payload
 
+rehash_tasks = set()
+
+def rehash_password(user_id: int, password: str, stored_password: str):
+	# los hashes SHA-512 antiguos (o scrypt con otro coste) se rehacen en segundo plano tras un login correcto
+	if not PasswordHasher.NeedsRehash(stored_password):
+		return
+
+	async def upgrade():
+		try:
+			await AsyncMySQL.UpdateItem("AD_USERS", ["password"], [await PasswordHasher.Hash(password)], "userID", (user_id,))
+		except Exception as error:
+			print(f"Error rehashing password for user {user_id}: {error}")
+
+	task = asyncio.get_running_loop().create_task(upgrade())
+	rehash_tasks.add(task)
+	task.add_done_callback(rehash_tasks.discard)
+
 async def log_action(user_id: int, user_ip: str, description: str, action_type: str):
-	try:
-		MySQL.AddItem("AD_LOGS", ["userID", "userIP", "logDate", "description", "type"], [user_id, user_ip, Now(), description, action_type])
-	except Exception as error:
-		print(f"Error logging action: {error}")
+	await AuditLog.Log(user_id, user_ip, description, action_type)
 
 @AuthRouter.post("/register", include_in_schema=True)
 async def register(request: fastapi.Request):
 	try:
 		RequestJSON: dict = await request.json()
 	except Exception as Error:
-		MySQL.LogError("/auth/register", None, IP.Extract(request), Now(), Error, "csrf_attempt")
+		AuditLog.Error("/auth/register", None, IP.Extract(request), Now(), Error, "csrf_attempt")
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("auth.no_json")})
 
 	Email = RequestJSON.get("email") if InputValidator.Email(RequestJSON.get("email")) == True else False
@@ -52,19 +67,17 @@ async def register(request: fastapi.Request):
 	if Password == False:
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("auth.no_password")})
 
-	if MySQL.ValueExists("AD_USERS", "email", Email) == True:
-		return fastapi.responses.JSONResponse(status_code=409, content={"status": 409, "message": GetMSG("register.already_registered")})
-
 	try:
-		user_id = MySQL.GetLastID("AD_USERS", "userID") + 1
-		MySQL.Register(user_id, IP.Extract(request), Email, hashlib.sha512(Password.encode("utf-8")).digest().hex(), TownID, JSON.Stringify({"requested": Now()}), Role)
+		user_id = await AsyncMySQL.Register(IP.Extract(request), Email, await PasswordHasher.Hash(Password), TownID, JSON.Stringify({"requested": Now()}), Role)
 		token = create_access_token({"email": Email, "role": Role})
 		
 		await log_action(user_id, IP.Extract(request), "User registered", "register")
 
 		return {"access_token": token}
 	except Exception as Error:
-		MySQL.LogError("/auth/register", None, IP.Extract(request), Now(), Error, "mysql_error")
+		if MySQL.IsDuplicate(Error):
+			return fastapi.responses.JSONResponse(status_code=409, content={"status": 409, "message": GetMSG("register.already_registered")})
+		AuditLog.Error("/auth/register", None, IP.Extract(request), Now(), Error, "mysql_error")
 		return fastapi.responses.JSONResponse(status_code=500, content={"status": 500, "message": GetMSG("register.bad")})
 
 @AuthRouter.post("/login", include_in_schema=True)
@@ -72,7 +85,7 @@ async def login(request: fastapi.Request):
 	try:
 		RequestJSON: dict = await request.json()
 	except Exception as Error:
-		MySQL.LogError("/auth/login", None, IP.Extract(request), Now(), Error, "csrf_attempt")
+		AuditLog.Error("/auth/login", None, IP.Extract(request), Now(), Error, "csrf_attempt")
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("auth.no_json")})
 
 	Email = RequestJSON.get("email") if InputValidator.Email(RequestJSON.get("email")) == True else False
@@ -83,17 +96,17 @@ async def login(request: fastapi.Request):
 	if Password == False:
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("auth.no_password")})
 
-	if MySQL.ValueExists("AD_USERS", "email", Email) == False:
+	user_data = await AsyncMySQL.FetchOne("SELECT userID, password, role, townID, verified FROM AD_USERS WHERE email = %s", (Email,))
+	if user_data is None:
 		return fastapi.responses.JSONResponse(status_code=404, content={"status": 404, "message": GetMSG("login.no_account")})
-
-	user_data = MySQL.FetchOne("SELECT userID, password, role, townID, verified FROM AD_USERS WHERE email = %s", (Email,))
 	user_id, stored_password, role, townID, verified = user_data
 
 	if verified == 0:
 		return fastapi.responses.JSONResponse(status_code=403, content={"status": 403, "message": "Account not verified. Please verify your account."})
 
-	if hashlib.sha512(Password.encode("utf-8")).digest().hex() != stored_password:
+	if not await PasswordHasher.Verify(Password, stored_password):
 		return fastapi.responses.JSONResponse(status_code=401, content={"status": 401, "message": GetMSG("login.invalid_password")})
+	rehash_password(user_id, Password, stored_password)
 
 	token = create_access_token({"email": Email, "role": role, "townID": townID})
 
@@ -107,12 +120,16 @@ async def user_info(user: dict = Depends(get_current_user)):
 	return {"user_info": email}
 
 @AuthRouter.get("/users", include_in_schema=True)
-async def get_users(current_user: dict = Depends(get_current_user)):
+async def get_users(request: Request, response: Response, limit: int = Query(Cursor.PageSize, ge=1, le=Cursor.MaxPageSize), cursor: Optional[str] = None,
+                    role: Optional[str] = None, verified: Optional[bool] = None, current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != 'admin':
         raise HTTPException(status_code=403, detail="Access denied: Only admins can access user data")
-    
+
+    after = Cursor.Decode(cursor) if cursor else None
+    where, params = SQLWhere({"u.role = %s": role, "u.verified = %s": verified, "u.userID > %s": after})
+
     try:
-        result = MySQL.FetchAll('SELECT u.userID, u.email, u.townID, u.dates, u.verified, t.townName, t.townImage FROM AD_USERS u LEFT JOIN AD_TOWNS t ON u.townID = t.townId')
+        result, next_cursor = Cursor.Page(await AsyncMySQL.FetchAll(f'SELECT u.userID, u.email, u.townID, u.dates, u.verified, t.townName, t.townImage FROM AD_USERS u LEFT JOIN AD_TOWNS t ON u.townID = t.townId{where} ORDER BY u.userID LIMIT %s', params + [limit + 1]), limit)
         users = [
             {
                 "userID": user[0],
@@ -124,6 +141,7 @@ async def get_users(current_user: dict = Depends(get_current_user)):
                 "townImage": user[6]
             } for user in result
         ]
+        Cursor.Link(request, response, next_cursor)
         return users
     except Exception as e:
         print("Error fetching users:", str(e))
@@ -134,7 +152,7 @@ async def admin_login(request: fastapi.Request):
 	try:
 		RequestJSON: dict = await request.json()
 	except Exception as Error:
-		MySQL.LogError("/auth/admin/login", None, IP.Extract(request), Now(), Error, "csrf_attempt")
+		AuditLog.Error("/auth/admin/login", None, IP.Extract(request), Now(), Error, "csrf_attempt")
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("auth.no_json")})
 
 	Email = RequestJSON.get("email") if InputValidator.Email(RequestJSON.get("email")) == True else False
@@ -145,14 +163,14 @@ async def admin_login(request: fastapi.Request):
 	if Password == False:
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("auth.no_password")})
 
-	if MySQL.ValueExists("AD_USERS", "email", Email) == False:
+	user_data = await AsyncMySQL.FetchOne("SELECT userID, password, role FROM AD_USERS WHERE email = %s", (Email,))
+	if user_data is None:
 		return fastapi.responses.JSONResponse(status_code=404, content={"status": 404, "message": GetMSG("login.no_account")})
-
-	user_data = MySQL.FetchOne("SELECT userID, password, role FROM AD_USERS WHERE email = %s", (Email,))
 	user_id, stored_password, role = user_data
 
-	if hashlib.sha512(Password.encode("utf-8")).digest().hex() != stored_password:
+	if not await PasswordHasher.Verify(Password, stored_password):
 		return fastapi.responses.JSONResponse(status_code=401, content={"status": 401, "message": GetMSG("login.invalid_password")})
+	rehash_password(user_id, Password, stored_password)
 
 	if role != 'admin':
 		return fastapi.responses.JSONResponse(status_code=403, content={"status": 403, "message": "Access denied: Admins only."})
@@ -177,7 +195,7 @@ async def update_user(user_id: int, request: Request, current_user: dict = Depen
 	if "email" in request_json:
 		update_data["email"] = request_json["email"]
 	if "password" in request_json:
-		update_data["password"] = hashlib.sha512(request_json["password"].encode("utf-8")).digest().hex()
+		update_data["password"] = await PasswordHasher.Hash(request_json["password"])
 	if "role" in request_json:
 		update_data["role"] = request_json["role"]
 	if "townID" in request_json:
@@ -192,39 +210,45 @@ async def update_user(user_id: int, request: Request, current_user: dict = Depen
 	values = list(update_data.values())
 
 	try:
-		MySQL.UpdateItem("AD_USERS", columns, values, "userID", (user_id,))
+		await AsyncMySQL.UpdateItem("AD_USERS", columns, values, "userID", (user_id,))
 
 		# Log action
 		await log_action(user_id, IP.Extract(request), "User updated", "update_user")
 
 		return {"status": "success", "message": "User updated successfully"}
 	except Exception as error:
-		MySQL.LogError("/auth/user/update", user_id, IP.Extract(request), Now(), error, "mysql_error")
+		AuditLog.Error("/auth/user/update", user_id, IP.Extract(request), Now(), error, "mysql_error")
 		raise HTTPException(status_code=500, detail="An error occurred while updating the user")
 
 @AuthRouter.delete("/user/{user_id}", include_in_schema=True)
-async def delete_user(user_id: int, current_user: dict = Depends(get_current_user)):
+async def delete_user(user_id: int, request: Request, current_user: dict = Depends(get_current_user)):
 	if current_user.get("role") != 'admin':
 		raise HTTPException(status_code=403, detail="Access denied: Only admins can delete user data")
 
 	try:
-		MySQL.Delete("AD_USERS", "userID", user_id)
+		await AsyncMySQL.Delete("AD_USERS", "userID", user_id)
 
 		# Log action
-		await log_action(user_id, IP.Extract(current_user), "User deleted", "delete_user")
+		await log_action(user_id, IP.Extract(request), "User deleted", "delete_user")
 
 		return {"status": "success", "message": "User deleted successfully"}
 	except Exception as error:
-		MySQL.LogError("/auth/user/delete", user_id, IP.Extract(current_user), Now(), error, "mysql_error")
+		AuditLog.Error("/auth/user/delete", user_id, IP.Extract(request), Now(), error, "mysql_error")
 		raise HTTPException(status_code=500, detail="An error occurred while deleting the user")
 
 @AuthRouter.get("/logs", include_in_schema=True)
-async def get_logs(current_user: dict = Depends(get_current_user)):
+async def get_logs(request: Request, response: Response, limit: int = Query(Cursor.PageSize, ge=1, le=Cursor.MaxPageSize), cursor: Optional[str] = None,
+                   type: Optional[str] = None, userID: Optional[int] = None, date_from: Optional[int] = Query(None, alias="from"),
+                   date_to: Optional[int] = Query(None, alias="to"), current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != 'admin':
         raise HTTPException(status_code=403, detail="Access denied: Only admins can access logs")
 
+    # los logs van del más reciente al más antiguo, así que el cursor apunta hacia atrás
+    before = Cursor.Decode(cursor) if cursor else None
+    where, params = SQLWhere({"type = %s": type, "userID = %s": userID, "logDate >= %s": date_from, "logDate <= %s": date_to, "logID < %s": before})
+
     try:
-        logs = MySQL.FetchAll("SELECT logID, userID, userIP, logDate, description, type FROM AD_LOGS")
+        logs, next_cursor = Cursor.Page(await AsyncMySQL.FetchAll(f"SELECT logID, userID, userIP, logDate, description, type FROM AD_LOGS{where} ORDER BY logID DESC LIMIT %s", params + [limit + 1]), limit)
         formatted_logs = [
             {
                 "logID": log[0],
@@ -235,13 +259,82 @@ async def get_logs(current_user: dict = Depends(get_current_user)):
                 "type": log[5]
             } for log in logs
         ]
+        Cursor.Link(request, response, next_cursor)
         return formatted_logs
     except Exception as e:
         print("Error fetching logs:", str(e))
         raise HTTPException(status_code=500, detail="An error occurred while fetching logs")
     
     
-@AuthRouter.post("/send-email")
+async def export_rows(chunks, columns: list, export_format: str, compress: bool, json_columns: tuple = ()):
+	# filas de AsyncMySQL.Stream a NDJSON o CSV (opcionalmente gzip) según van llegando
+	# Las columnas guardadas como texto JSON (dates) se decodifican en NDJSON para que coincidan con /auth/users; en CSV se quedan como texto
+	decoded = [index for index, column in enumerate(columns) if column in json_columns]
+	compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+	def encode(text: str) -> bytes:
+		data = text.encode("utf-8")
+		return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else data
+
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	if export_format == "csv":
+		writer.writerow(columns)
+		yield encode(buffer.getvalue())
+
+	async for rows in chunks:
+		buffer.seek(0)
+		buffer.truncate()
+		if export_format == "csv":
+			writer.writerows(rows)
+		else:
+			for row in rows:
+				if decoded:
+					row = list(row)
+					for index in decoded:
+						row[index] = json.loads(row[index]) if row[index] else row[index]
+				buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+				buffer.write("\n")
+		yield encode(buffer.getvalue())
+
+	if compressor:
+		yield compressor.flush()
+
+def export_response(chunks, columns: list, export_format: str, compress: bool, filename: str, json_columns: tuple = ()):
+	headers = {"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+	if compress:
+		headers["Content-Encoding"] = "gzip"
+	media_type = "text/csv; charset=utf-8" if export_format == "csv" else "application/x-ndjson"
+	return fastapi.responses.StreamingResponse(export_rows(chunks, columns, export_format, compress, json_columns), media_type=media_type, headers=headers)
+
+@AuthRouter.get("/users/export", include_in_schema=True)
+async def export_users(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), gzip: bool = False, role: Optional[str] = None,
+					   verified: Optional[bool] = None, current_user: dict = Depends(get_current_user)):
+	if current_user.get("role") != 'admin':
+		raise HTTPException(status_code=403, detail="Access denied: Only admins can access user data")
+
+	where, params = SQLWhere({"u.role = %s": role, "u.verified = %s": verified})
+	chunks = AsyncMySQL.Stream(f"SELECT u.userID, u.email, u.townID, u.dates, u.verified, u.role, t.townName FROM AD_USERS u LEFT JOIN AD_TOWNS t ON u.townID = t.townId{where} ORDER BY u.userID", params)
+	return export_response(chunks, ["userID", "email", "townID", "dates", "verified", "role", "townName"], format, gzip, "users", ("dates",))
+
+@AuthRouter.get("/logs/export", include_in_schema=True)
+async def export_logs(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), gzip: bool = False, type: Optional[str] = None, userID: Optional[int] = None,
+					  date_from: Optional[int] = Query(None, alias="from"), date_to: Optional[int] = Query(None, alias="to"), current_user: dict = Depends(get_current_user)):
+	if current_user.get("role") != 'admin':
+		raise HTTPException(status_code=403, detail="Access denied: Only admins can access logs")
+
+	where, params = SQLWhere({"type = %s": type, "userID = %s": userID, "logDate >= %s": date_from, "logDate <= %s": date_to})
+	chunks = AsyncMySQL.Stream(f"SELECT logID, userID, userIP, logDate, description, type FROM AD_LOGS{where} ORDER BY logID", params)
+	return export_response(chunks, ["logID", "userID", "userIP", "logDate", "description", "type"], format, gzip, "logs")
+
+@AuthRouter.get("/stats", include_in_schema=True)
+async def get_stats(current_user: dict = Depends(get_current_user)):
+	if current_user.get("role") != 'admin':
+		raise HTTPException(status_code=403, detail="Access denied: Only admins can access stats")
+
+	return {"pool": MySQL.PoolStats(), "catalog_cache": CatalogCache.Stats(), "random_towns": VisibleTowns.Stats(), "audit": AuditLog.Stats(), "jwt_cache": verified_tokens.Stats(), "mail": Mailer.Stats(), "search": CatalogSearch.Stats(), "events": EventCalendar.Stats()}
+
+@AuthRouter.post("/send-email", status_code=202)
 async def send_email(request: Request):
     try:
         data = await request.json()
@@ -249,28 +342,24 @@ async def send_email(request: Request):
         to_email = data["to_email"]
         subject = data["subject"]
         body = data["body"]
-
-        # Crear el mensaje
-        msg = MIMEMultipart()
-        msg["From"] = from_email
-        msg["To"] = to_email
-        msg["Subject"] = subject
-
-        # Agregar cuerpo del mensaje en formato HTML
-        msg.attach(MIMEText(body, "html"))
-
-        # Conectarse al servidor SMTP y enviar el correo
-        try:
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            server.starttls()  # Iniciar TLS
-            server.login(smtp_username, smtp_password)
-            server.sendmail(from_email, to_email, msg.as_string())
-            server.quit()
-            return {"message": "Email sent successfully!"}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to send email: {e}")
-
     except KeyError as e:
         raise HTTPException(status_code=400, detail=f"Missing field in request body: {e}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred: {e}")
+        raise HTTPException(status_code=400, detail=f"An error occurred: {e}")
+
+    # El correo se encola y lo envía el worker de utils.mail con una sesión SMTP persistente
+    try:
+        message_id = Mailer.Enqueue(from_email, to_email, subject, body)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Email queue is full, try again later")
+    return {"status": 202, "message": "Email queued", "id": message_id}
+
+@AuthRouter.get("/send-email/{message_id}")
+async def get_email_status(message_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user.get("role") != 'admin':
+        raise HTTPException(status_code=403, detail="Access denied: Only admins can access email status")
+
+    status = Mailer.Status(message_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Email not found")
+    return status
@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import datetime
 import fastapi
-from fastapi import HTTPException, Request
+from fastapi import HTTPException, Query, Request
 from typing import List, Optional
-from utils.database import MySQL
-from pydantic import BaseModel
-from utils.easify import GetMSG, Now
+from utils.audit import AuditLog
+from utils.cache import CatalogCache
+from utils.catalog import EventCalendar, VisibleTowns
+from utils.changes import ChangeFeed
+from utils.database import AsyncMySQL
+from pydantic import BaseModel, ValidationError
+from utils.easify import Cursor, Encoded, ETag, FastJSON, GetMSG, Now, SQLWhere
 from utils.files import JSON
+from utils.httpcache import HTTPCache
+from utils.search import CatalogSearch
 from utils.security import IP
 
 TownsRouter = fastapi.APIRouter()
@@ -61,19 +68,246 @@ class Event(EventBase):
 	eventId: int
 	townId: int
 
+class SearchResult(BaseModel):
+	type: str
+	id: int
+	townId: int
+	name: str
+	score: float
+
+class Change(BaseModel):
+	type: str
+	id: int
+	townId: Optional[int] = None
+	action: str
+	data: Optional[dict] = None
+
+class ChangesPage(BaseModel):
+	changes: List[Change]
+	next: str
+	more: bool
+
+class TownDetail(Town):
+	dishes: Optional[List[Dish]] = None
+	monuments: Optional[List[Monument]] = None
+	events: Optional[List[Event]] = None
+
+# las filas pasan directamente a dicts con los mismos campos (y en el mismo orden) que los modelos, sin construir un modelo por fila;
+# los modelos siguen en response_model para la documentación y para validar lo que llega
+def town_from_row(town):
+	return {"townName": town[1], "townDescription": town[2], "townImage": town[3], "townMap": town[4], "townProvince": town[5],
+			"townVisibility": None if town[6] is None else bool(town[6]), "townId": town[0]}
+
+def dish_from_row(dish):
+	return {"dishName": dish[1], "dishDescription": dish[2], "dishImage": dish[3], "dishId": dish[0], "townId": dish[4]}
+
+def monument_from_row(monument):
+	return {"monumentName": monument[1], "monumentDescription": monument[2], "monumentImage": monument[3], "monumentId": monument[0], "townId": monument[4]}
+
+def event_from_row(event):
+	return {"eventName": event[1], "eventDate": event[2], "eventDescription": event[3], "eventId": event[0], "townId": event[4]}
+
+TOWN_SELECT = "SELECT townId, townName, townDescription, townImage, townMap, townProvince, townVisibility FROM AD_TOWNS"
+TOWN_QUERY = TOWN_SELECT + " WHERE townId = %s"
+DISH_SELECT = "SELECT dishId, dishName, dishDescription, dishImage, townId FROM AD_DISHES"
+MONUMENT_SELECT = "SELECT monumentId, monumentName, monumentDescription, monumentImage, townId FROM AD_MONUMENTS"
+EVENT_SELECT = "SELECT eventId, eventName, DATE_FORMAT(eventDate, '%Y-%m-%d') as eventDate, eventDescription, townId FROM AD_EVENTS"
+
+MAX_BATCH = 1000
+
+# sub-recursos de un pueblo: consulta por townId y cómo convertir cada fila
+SUBRESOURCES = {
+	"dishes": (DISH_SELECT + " WHERE townId = %s", dish_from_row),
+	"monuments": (MONUMENT_SELECT + " WHERE townId = %s", monument_from_row),
+	"events": (EVENT_SELECT + " WHERE townId = %s", event_from_row),
+}
+
+# tipos del feed de cambios: consulta base, columna del ID y conversión de cada fila
+CHANGE_RESOURCES = {
+	"town": (TOWN_SELECT, "townId", town_from_row),
+	"dish": (DISH_SELECT, "dishId", dish_from_row),
+	"monument": (MONUMENT_SELECT, "monumentId", monument_from_row),
+	"event": (EVENT_SELECT, "eventId", event_from_row),
+}
+
+# campos de cada listado en el orden de los modelos y vista compacta (lo que enseñan las tarjetas), para ?fields= y ?view=compact
+FIELDS = {
+	"towns": ("townName", "townDescription", "townImage", "townMap", "townProvince", "townVisibility", "townId"),
+	"dishes": ("dishName", "dishDescription", "dishImage", "dishId", "townId"),
+	"monuments": ("monumentName", "monumentDescription", "monumentImage", "monumentId", "townId"),
+	"events": ("eventName", "eventDate", "eventDescription", "eventId", "townId"),
+}
+COMPACT_FIELDS = {
+	"towns": ("townName", "townImage", "townProvince", "townId"),
+	"dishes": ("dishName", "dishImage", "dishId", "townId"),
+	"monuments": ("monumentName", "monumentImage", "monumentId", "townId"),
+	"events": ("eventName", "eventDate", "eventId", "townId"),
+}
+ID_FIELDS = {"towns": "townId", "dishes": "dishId", "monuments": "monumentId", "events": "eventId"}
+TABLES = {"towns": "AD_TOWNS", "dishes": "AD_DISHES", "monuments": "AD_MONUMENTS", "events": "AD_EVENTS"}
+COLUMN_SQL = {"eventDate": "DATE_FORMAT(eventDate, '%Y-%m-%d')"}
+
+def parse_fields(resource: str, fields: Optional[str], view: Optional[str]) -> Optional[tuple]:
+	# campos de ?fields= o ?view=compact en el orden del modelo y con el ID; None es la respuesta completa
+	if fields:
+		requested = {field.strip() for field in fields.split(",") if field.strip()}
+		unknown = requested - set(FIELDS[resource])
+		if unknown:
+			raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(FIELDS[resource])}")
+		selected = tuple(field for field in FIELDS[resource] if field in requested or field == ID_FIELDS[resource])
+	elif view == "compact":
+		selected = COMPACT_FIELDS[resource]
+	else:
+		return None
+	return None if selected == FIELDS[resource] else selected
+
+def projected_select(resource: str, fields: tuple) -> str:
+	return f"SELECT {', '.join(COLUMN_SQL.get(field, field) for field in fields)} FROM {TABLES[resource]}"
+
+def projected_from_row(fields: tuple, row) -> dict:
+	item = dict(zip(fields, row))
+	if item.get("townVisibility") is not None:
+		item["townVisibility"] = bool(item["townVisibility"])
+	return item
+
 async def log_action(user_id, user_ip, description, action_type):
-	MySQL.AddItem(
-		"AD_LOGS",
-		["userID", "userIP", "logDate", "description", "type"],
-		[user_id, user_ip, Now(), description, action_type]
-	)
+	await AuditLog.Log(user_id, user_ip, description, action_type)
+
+async def fetch_towns(town_ids: list, fields: Optional[tuple] = None) -> list:
+	# pueblos pedidos en ese orden: los de la caché salen de ella y el resto de un solo IN (...)
+	key = (lambda town_id: ("town", town_id)) if fields is None else (lambda town_id: ("town", town_id, fields))
+	query, from_row, id_index = (TOWN_SELECT, town_from_row, 0) if fields is None else (projected_select("towns", fields), lambda row: projected_from_row(fields, row), fields.index("townId"))
+	generation = CatalogCache.Generation
+	towns = {town_id: CatalogCache.Get(key(town_id)) for town_id in dict.fromkeys(town_ids)}
+	missing = [town_id for town_id, town in towns.items() if town is None]
+	if missing:
+		rows = await AsyncMySQL.FetchAll(f"{query} WHERE townId IN ({', '.join(['%s'] * len(missing))})", missing)
+		for row in rows:
+			towns[row[id_index]] = Encoded(from_row(row))
+			CatalogCache.Set(key(row[id_index]), towns[row[id_index]], Generation=generation)
+	return [towns[town_id] for town_id in towns if towns[town_id] is not None]
+
+async def fetch_subresource(resource: str, town_id: int, fields: Optional[tuple] = None):
+	query, from_row = SUBRESOURCES[resource] if fields is None else (projected_select(resource, fields) + " WHERE townId = %s", lambda row: projected_from_row(fields, row))
+
+	async def load():
+		return Encoded([from_row(row) for row in await AsyncMySQL.FetchAll(query, (town_id,))])
+
+	return await CatalogCache.Fetch((resource, town_id) if fields is None else (resource, town_id, fields), load)
+
+async def fetch_changed(changes: dict) -> dict:
+	# estado actual de los "upsert" leído siempre de MySQL: la caché de este worker puede ir atrasada
+	wanted = {}
+	for (resource, resource_id), (_, action) in changes.items():
+		if action == "upsert":
+			wanted.setdefault(resource, []).append(resource_id)
+	current = {}
+	kinds = [kind for kind in wanted if kind in CHANGE_RESOURCES]
+	if kinds:
+		queries = [(f"{CHANGE_RESOURCES[kind][0]} WHERE {CHANGE_RESOURCES[kind][1]} IN ({', '.join(['%s'] * len(wanted[kind]))})", wanted[kind]) for kind in kinds]
+		for kind, rows in zip(kinds, await AsyncMySQL.FetchBatch(queries)):
+			for row in rows:
+				current[(kind, row[0])] = CHANGE_RESOURCES[kind][2](row)
+	return current
+
+async def bulk_create(request: Request, model, table: str, id_column: str, town_id: Optional[int], existing_names: Optional[str] = None):
+	# valida la lista elemento a elemento e inserta los válidos con un solo executemany; 409 si el nombre se repite
+	try:
+		items = await request.json()
+	except Exception as e:
+		AuditLog.Error(request.url.path, None, IP.Extract(request), Now(), e, "csrf_attempt")
+		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("towns.no_json")})
+	if not isinstance(items, list) or not items or len(items) > MAX_BATCH:
+		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("towns.invalid_batch").format(MAX_BATCH)})
+
+	results, valid = {}, []
+	for index, item in enumerate(items):
+		try:
+			valid.append((index, model.parse_obj(item).dict()))
+		except ValidationError as e:
+			results[index] = {"index": index, "status": 422, "errors": [{"loc": list(error["loc"]), "msg": error["msg"]} for error in e.errors()]}
+
+	if existing_names and valid:
+		names = [item[existing_names] for _, item in valid]
+		taken = {row[0] for row in await AsyncMySQL.FetchAll(f"SELECT {existing_names} FROM {table} WHERE {existing_names} IN ({', '.join(['%s'] * len(names))})", names)}
+		unique = []
+		for index, item in valid:
+			if item[existing_names] in taken:
+				results[index] = {"index": index, "status": 409, "message": GetMSG("towns.already_exists")}
+			else:
+				taken.add(item[existing_names])
+				unique.append((index, item))
+		valid = unique
+
+	created = []
+	if valid:
+		rows = [{**item, "townId": town_id} if town_id is not None else item for _, item in valid]
+		columns = list(rows[0])
+		new_ids = await AsyncMySQL.AddItems(table, columns, [[row[column] for column in columns] for row in rows])
+		for (index, _), row, new_id in zip(valid, rows, new_ids):
+			created.append({id_column: new_id, **row})
+			results[index] = {"index": index, "status": 201, "data": created[-1]}
+
+	return [results[index] for index in sorted(results)], created
+
+def bulk_response(outcome, noun: str):
+	if isinstance(outcome, fastapi.responses.JSONResponse):
+		return outcome
+	results, created = outcome
+	return {"status": 200, "message": f"{len(created)} of {len(results)} {noun} created", "created": len(created), "results": results}
+
+def invalidate_catalog(town_id: int, *resources: str):
+	# borra de la caché las entradas del pueblo y marca sus claves HTTP como cambiadas ("catalog" siempre)
+	keys = ["catalog"]
+	for resource in resources:
+		if resource == "towns":
+			CatalogCache.Invalidate("towns")
+			keys.append("towns")
+		else:
+			CatalogCache.Invalidate(resource, town_id)
+			keys.append(f"{resource}-{town_id}")
+	HTTPCache.Changed(keys)
+
+async def catalog_response(request: Request, load, keys: list, public: bool = True, vary: tuple = ()):
+	# load() solo se llama si el cliente no tiene ya la versión actual; vary es lo que cambia la respuesta fuera de la URL
+	version = await HTTPCache.Version() if public else None
+	etag = HTTPCache.VersionTag(request, version, vary) if version is not None else None
+	if etag is not None and HTTPCache.NotModified(request, etag):
+		return HTTPCache.Respond(request, b"", etag, keys, public)
+	body = await load()
+	if isinstance(body, Encoded):
+		return HTTPCache.Respond(request, body.Body, etag or body.ETag, keys, public)
+	return HTTPCache.Respond(request, body, etag or ETag(body), keys, public)
+
+def index_town(town_id: int, town: dict):
+	# pasa una localidad creada o actualizada a los índices en memoria
+	VisibleTowns.Set(town_id, town["townVisibility"])
+	CatalogSearch.Town(town_id, town["townName"], town.get("townDescription"), town.get("townProvince"), town["townVisibility"])
+	EventCalendar.SetTown(town_id, town.get("townProvince"), town["townVisibility"])
+
+def unindex_town(town_id: int):
+	VisibleTowns.Remove(town_id)
+	CatalogSearch.Remove("town", town_id)
+	EventCalendar.RemoveTown(town_id)
+
+def index_items(kind: str, items: list):
+	# pasa al buscador (y a la agenda si son eventos) los elementos recién creados
+	for item in items:
+		CatalogSearch.Put(kind, item[f"{kind}Id"], item["townId"], item[f"{kind}Name"], item.get(f"{kind}Description"))
+		if kind == "event":
+			EventCalendar.Put((item["eventId"], item["eventName"], item.get("eventDate"), item.get("eventDescription"), item["townId"]))
+
+def unindex_item(kind: str, item_id: int):
+	CatalogSearch.Remove(kind, item_id)
+	if kind == "event":
+		EventCalendar.Remove(item_id)
 
 @TownsRouter.post("/towns", response_model=Town)
 async def create_town(request: Request):
 	try:
 		request_json: dict = await request.json()
 	except Exception as e:
-		MySQL.LogError("/towns", None, IP.Extract(request), Now(), e, "csrf_attempt")
+		AuditLog.Error("/towns", None, IP.Extract(request), Now(), e, "csrf_attempt")
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("towns.no_json")})
 	
 	townName = request_json.get("townName")
@@ -85,13 +319,15 @@ async def create_town(request: Request):
 
 	if not townName:
 		return fastapi.responses.JSONResponse(status_code=400, content={"status": 400, "message": GetMSG("towns.invalid_data")})
-	if MySQL.ValueExists("AD_TOWNS", "townName", townName):
+	if await AsyncMySQL.ValueExists("AD_TOWNS", "townName", townName):
 		return fastapi.responses.JSONResponse(status_code=409, content={"status": 409, "message": GetMSG("towns.already_exists")})
 	
 	try:
-		new_town_id = MySQL.GetLastID("AD_TOWNS", "townId") + 1
-		MySQL.AddTown(new_town_id, townName, townDescription, townImage, townMap, townProvince, townVisibility)
+		new_town_id = await AsyncMySQL.AddTown(townName, townDescription, townImage, townMap, townProvince, townVisibility)
+		invalidate_catalog(new_town_id, "towns", "town")
+		index_town(new_town_id, {"townName": townName, "townDescription": townDescription, "townProvince": townProvince, "townVisibility": townVisibility})
 		
+		await ChangeFeed.Record("town", "upsert", [(new_town_id, new_town_id)])
 		await log_action(new_town_id, IP.Extract(request), "Town created", "create_town")
 		
 		return fastapi.responses.JSONResponse(status_code=200, content={
@@ -101,55 +337,231 @@ async def create_town(request: Request):
 		print(e)
 		return fastapi.responses.JSONResponse(status_code=500, content={"status": 500, "message": GetMSG("towns.error")})
 
-@TownsRouter.get("/towns", response_model=List[Town])
-async def get_towns():
+@TownsRouter.post("/towns/bulk", response_model=dict)
+async def create_towns_bulk(request: Request):
 	try:
-		towns = MySQL.FetchAll("SELECT townId, townName, townDescription, townImage, townMap, townProvince, townVisibility FROM AD_TOWNS")
+		outcome = await bulk_create(request, TownCreate, "AD_TOWNS", "townId", None, existing_names="townName")
+		if not isinstance(outcome, fastapi.responses.JSONResponse) and outcome[1]:
+			invalidate_catalog(None, "towns")
+			for town in outcome[1]:
+				index_town(town["townId"], town)
+			await ChangeFeed.Record("town", "upsert", [(town["townId"], town["townId"]) for town in outcome[1]])
+			await log_action(outcome[1][0]["townId"], IP.Extract(request), f"{len(outcome[1])} towns created", "create_town_bulk")
+		return bulk_response(outcome, "towns")
+	except Exception as e:
+		print(e)
+		return fastapi.responses.JSONResponse(status_code=500, content={"status": 500, "message": GetMSG("towns.error")})
+
+@TownsRouter.get("/towns", response_model=List[Town])
+async def get_towns(request: Request, limit: int = Query(Cursor.PageSize, ge=1, le=Cursor.MaxPageSize), cursor: Optional[str] = None,
+					province: Optional[str] = None, visibility: Optional[bool] = None, ids: Optional[str] = None,
+					fields: Optional[str] = None, view: Optional[str] = Query(None, pattern="^(compact|full)$")):
+	projection = parse_fields("towns", fields, view)
+	if ids is not None:
+		try:
+			town_ids = [int(town_id) for town_id in ids.split(",") if town_id.strip()]
+		except ValueError:
+			raise HTTPException(status_code=400, detail="ids must be a comma separated list of town IDs")
+		if len(town_ids) > MAX_BATCH:
+			raise HTTPException(status_code=400, detail=f"ids accepts at most {MAX_BATCH} town IDs")
+		async def load_ids():
+			try:
+				return Encoded.Array(await fetch_towns(town_ids, projection))
+			except Exception as e:
+				raise HTTPException(status_code=500, detail=str(e))
+
+		return await catalog_response(request, load_ids, ["towns"])
+
+	after = Cursor.Decode(cursor) if cursor else None
+
+	async def load_towns():
+		where, params = SQLWhere({"townProvince = %s": province, "townVisibility = %s": visibility, "townId > %s": after})
+		# con fields/view solo se leen de MySQL las columnas pedidas
+		select = TOWN_SELECT if projection is None else projected_select("towns", projection)
+		query = f"{select}{where} ORDER BY townId LIMIT %s"
+		towns, next_cursor = Cursor.Page(await AsyncMySQL.FetchAll(query, params + [limit + 1]), limit, 0 if projection is None else projection.index("townId"))
 		print("Towns fetched from database:", towns)
 		
-		return [Town(townId=town[0], townName=town[1], townDescription=town[2], townImage=town[3], 
-					 townMap=town[4], townProvince=town[5], townVisibility=town[6]) for town in towns]
-	except Exception as e:
-		print("Error fetching towns:", str(e))
-		raise HTTPException(status_code=500, detail=str(e))
+		if projection is None:
+			return Encoded([town_from_row(town) for town in towns]), next_cursor
+		return Encoded([projected_from_row(projection, town) for town in towns]), next_cursor
+
+	next_cursor = None
+
+	async def load_page():
+		nonlocal next_cursor
+		try:
+			towns, next_cursor = await CatalogCache.Fetch(("towns", province, visibility, after, limit, projection), load_towns)
+		except Exception as e:
+			print("Error fetching towns:", str(e))
+			raise HTTPException(status_code=500, detail=str(e))
+		return towns
+
+	# en un 304 no se ha leído la página, así que no hay Link: el cliente ya lo tiene de la respuesta que guardó
+	response = await catalog_response(request, load_page, ["towns"])
+	Cursor.Link(request, response, next_cursor)
+	return response
 
 @TownsRouter.get("/towns/random/{town_count}", response_model=List[Town])
-async def get_randomtowns(town_count: int):
+async def get_randomtowns(town_count: int, request: Request, seed: Optional[int] = None, fields: Optional[str] = None, view: Optional[str] = Query(None, pattern="^(compact|full)$")):
+	projection = parse_fields("towns", fields, view)
+	async def load_sample():
+		try:
+			# se sortean los IDs en memoria y los pueblos salen de la caché del catálogo (o de un IN por clave primaria)
+			return Encoded.Array(await fetch_towns(await VisibleTowns.Sample(min(town_count, MAX_BATCH), seed), projection))
+		except Exception as e:
+			print("Error fetching towns:", str(e))
+			raise HTTPException(status_code=500, detail=str(e))
+
+	# sin seed cada respuesta es distinta: no se puede guardar en la CDN
+	return await catalog_response(request, load_sample, ["towns"], public=seed is not None)
+
+@TownsRouter.get("/search", response_model=List[SearchResult])
+async def search_catalog(request: Request, q: str = Query(..., min_length=1, max_length=100), type: Optional[str] = None, limit: int = Query(20, ge=1, le=100)):
+	kinds = [kind for kind in type.split(",") if kind] if type else None
+	if kinds and any(kind not in CatalogSearch.Kinds for kind in kinds):
+		raise HTTPException(status_code=400, detail=f"type must be a comma separated list of: {', '.join(CatalogSearch.Kinds)}")
+	async def load_results():
+		try:
+			# el índice vive en memoria: solo se consulta MySQL al cargarlo o recargarlo
+			return JSON.Encode(await CatalogSearch.Search(q, kinds, limit))
+		except Exception as e:
+			print("Error searching catalog:", str(e))
+			raise HTTPException(status_code=500, detail=str(e))
+
+	return await catalog_response(request, load_results, ["catalog"])
+
+async def events_page(request: Request, date_from: Optional[str], date_to: Optional[str], province: Optional[str],
+					  town: Optional[int], limit: int, cursor: Optional[str]):
+	dates = [EventCalendar.Date(date) if date else None for date in (date_from, date_to)]
+	if any(date is None and raw for date, raw in zip(dates, (date_from, date_to))):
+		raise HTTPException(status_code=400, detail="from and to must be dates in YYYY-MM-DD format")
+	after = Cursor.Decode(cursor, list) if cursor else None
+	if after is not None and not (len(after) == 2 and isinstance(after[0], str) and isinstance(after[1], int)):
+		raise HTTPException(status_code=400, detail=GetMSG("api.bad_cursor"))
+	next_key = None
+
+	async def load_events():
+		nonlocal next_key
+		try:
+			rows, next_key = await EventCalendar.Range(dates[0], dates[1], province, town, tuple(after) if after else None, limit)
+		except Exception as e:
+			print("Error fetching events:", str(e))
+			raise HTTPException(status_code=500, detail="Internal server error while fetching events")
+		return JSON.Encode([event_from_row(row) for row in rows])
+
+	response = await catalog_response(request, load_events, ["catalog"], vary=tuple(dates))
+	Cursor.Link(request, response, Cursor.Encode(next_key) if next_key else None)
+	return response
+
+@TownsRouter.get("/events", response_model=List[Event])
+async def get_events(request: Request, date_from: Optional[str] = Query(None, alias="from"), date_to: Optional[str] = Query(None, alias="to"),
+					 province: Optional[str] = None, town: Optional[int] = None, limit: int = Query(Cursor.PageSize, ge=1, le=Cursor.MaxPageSize), cursor: Optional[str] = None):
+	# agenda de todas las localidades ordenada por fecha; sale de un índice en memoria, no de una consulta por pueblo
+	return await events_page(request, date_from, date_to, province, town, limit, cursor)
+
+@TownsRouter.get("/events/upcoming", response_model=List[Event])
+async def get_upcoming_events(request: Request, days: Optional[int] = Query(None, ge=1, le=366), province: Optional[str] = None,
+							  town: Optional[int] = None, limit: int = Query(20, ge=1, le=MAX_BATCH), cursor: Optional[str] = None):
+	today = datetime.date.today()
+	date_to = (today + datetime.timedelta(days=days)).isoformat() if days else None
+	return await events_page(request, today.isoformat(), date_to, province, town, limit, cursor)
+
+@TownsRouter.get("/changes", response_model=ChangesPage)
+async def get_changes(since: Optional[str] = None, limit: int = Query(500, ge=1, le=MAX_BATCH)):
+	# sin since solo se devuelve el cursor actual: el cliente lo guarda, descarga el catálogo y a partir de ahí sincroniza con since
+	after = Cursor.Decode(since) if since else None
 	try:
-		towns = MySQL.FetchAll("SELECT townId, townName, townDescription, townImage, townMap, townProvince FROM AD_TOWNS WHERE townVisibility = 1 ORDER BY RAND() LIMIT %s", (town_count,))
-		print("Towns fetched from database:", towns)
-		
-		return [Town(townId=town[0], townName=town[1], townDescription=town[2], townImage=town[3], 
-					 townMap=town[4], townProvince=town[5]) for town in towns]
+		if after is None:
+			return FastJSON({"changes": [], "next": Cursor.Encode(await ChangeFeed.Head()), "more": False}, headers={"Cache-Control": "no-store"})
+		rows, more = await ChangeFeed.Read(after, limit)
+		# si un elemento cambia varias veces en la página solo cuenta el último cambio, en su posición
+		latest = {}
+		for _, resource, resource_id, town_id, action in rows:
+			latest.pop((resource, resource_id), None)
+			latest[(resource, resource_id)] = (town_id, action)
+		current = await fetch_changed(latest)
 	except Exception as e:
-		print("Error fetching towns:", str(e))
+		print("Error fetching changes:", str(e))
 		raise HTTPException(status_code=500, detail=str(e))
 
+	changes = []
+	for (resource, resource_id), (town_id, action) in latest.items():
+		# un "upsert" de algo que ya no existe es que se borró después: se manda como borrado
+		data = current.get((resource, resource_id)) if action == "upsert" else None
+		changes.append({"type": resource, "id": resource_id, "townId": town_id, "action": "upsert" if data is not None else "delete", "data": data})
+	page = {"changes": changes, "next": Cursor.Encode(rows[-1][0] if rows else after), "more": more}
+	return FastJSON(page, headers={"Cache-Control": "no-store"})
+
 @TownsRouter.get("/towns/{town_id}", response_model=Town)
-async def get_town(town_id: int):
-	try:
-		town = MySQL.FetchOne("SELECT townId, townName, townDescription, townImage, townMap, townProvince, townVisibility FROM AD_TOWNS WHERE townId = %s", (town_id,))
+async def get_town(town_id: int, request: Request):
+	async def load_town():
+		town = await AsyncMySQL.FetchOne(TOWN_QUERY, (town_id,))
 		if not town:
+			return None
+		return Encoded(town_from_row(town))
+
+	async def load():
+		try:
+			town = await CatalogCache.Fetch(("town", town_id), load_town)
+		except Exception as e:
+			raise HTTPException(status_code=500, detail=str(e))
+		if town is None:
 			raise HTTPException(status_code=404, detail="Town not found")
-		return Town(townId=town[0], townName=town[1], townDescription=town[2], townImage=town[3], 
-					townMap=town[4], townProvince=town[5], townVisibility=town[6])
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=str(e))
+		return town
+
+	return await catalog_response(request, load, [f"town-{town_id}"])
+
+@TownsRouter.get("/towns/{town_id}/detail", response_model=TownDetail, response_model_exclude_unset=True)
+async def get_town_detail(town_id: int, request: Request, include: str = "dishes,monuments,events"):
+	resources = list(dict.fromkeys(resource for resource in include.split(",") if resource))
+	if any(resource not in SUBRESOURCES for resource in resources):
+		raise HTTPException(status_code=400, detail=f"include must be a comma separated list of: {', '.join(SUBRESOURCES)}")
+
+	async def load():
+		# lo que ya está en la caché del catálogo no se vuelve a pedir; el resto va en una sola conexión
+		generation = CatalogCache.Generation
+		parts = {"town": CatalogCache.Get(("town", town_id))}
+		parts.update({resource: CatalogCache.Get((resource, town_id)) for resource in resources})
+		missing = [name for name, value in parts.items() if value is None]
+
+		if missing:
+			try:
+				results = await AsyncMySQL.FetchBatch([(TOWN_QUERY if name == "town" else SUBRESOURCES[name][0], (town_id,)) for name in missing])
+			except Exception as e:
+				raise HTTPException(status_code=500, detail=str(e))
+			for name, rows in zip(missing, results):
+				if name == "town":
+					parts["town"] = Encoded(town_from_row(rows[0])) if rows else None
+				else:
+					parts[name] = Encoded([SUBRESOURCES[name][1](row) for row in rows])
+				if parts[name] is not None:
+					CatalogCache.Set((name, town_id), parts[name], Generation=generation)
+
+		if parts["town"] is None:
+			raise HTTPException(status_code=404, detail="Town not found")
+		# el JSON del pueblo y de cada sub-recurso ya está codificado en la caché: se empalman los bytes
+		return parts["town"].Body[:-1] + b"".join(b',"%s":%s' % (resource.encode(), parts[resource].Body) for resource in SUBRESOURCES if resource in resources) + b"}"
+
+	return await catalog_response(request, load, [f"town-{town_id}", *(f"{resource}-{town_id}" for resource in resources)])
 
 @TownsRouter.put("/towns/{town_id}", response_model=Town)
 async def update_town(town_id: int, town: TownCreate, request: Request):
 	try:
-		if not MySQL.ValueExists("AD_TOWNS", "townId", town_id):
+		if not await AsyncMySQL.ValueExists("AD_TOWNS", "townId", town_id):
 			raise HTTPException(status_code=404, detail="Town not found")
   
-		MySQL.UpdateItem(
+		await AsyncMySQL.UpdateItem(
 			"AD_TOWNS",
 			["townName", "townDescription", "townImage", "townMap", "townProvince", "townVisibility"],
 			[town.townName, town.townDescription, town.townImage, town.townMap, town.townProvince, town.townVisibility],
 			"townId",
 			[town_id]
 		)
+		invalidate_catalog(town_id, "towns", "town")
+		index_town(town_id, town.dict())
 
+		await ChangeFeed.Record("town", "upsert", [(town_id, town_id)])
 		await log_action(town_id, IP.Extract(request), "Town updated", "update_town")
 		
 		return {"townId": town_id, **town.dict()}
@@ -159,11 +571,14 @@ async def update_town(town_id: int, town: TownCreate, request: Request):
 @TownsRouter.delete("/towns/{town_id}", response_model=dict)
 async def delete_town(town_id: int, request: Request):
 	try:
-		if not MySQL.ValueExists("AD_TOWNS", "townId", town_id):
+		if not await AsyncMySQL.ValueExists("AD_TOWNS", "townId", town_id):
 			raise HTTPException(status_code=404, detail="Town not found")
 
-		MySQL.Delete("AD_TOWNS", "townId", town_id)
+		await AsyncMySQL.Delete("AD_TOWNS", "townId", town_id)
+		invalidate_catalog(town_id, "towns", "town", "dishes", "monuments", "events")
+		unindex_town(town_id)
 
+		await ChangeFeed.Record("town", "delete", [(town_id, town_id)])
 		await log_action(town_id, IP.Extract(request), "Town deleted", "delete_town")
 
 		return {"status": "success", "message": "Town deleted successfully"}
@@ -171,23 +586,28 @@ async def delete_town(town_id: int, request: Request):
 		raise HTTPException(status_code=500, detail=str(e))
 
 @TownsRouter.get("/towns/{town_id}/dishes", response_model=List[Dish])
-async def get_town_dishes(town_id: int):
-	try:
-		dishes = MySQL.FetchAll("SELECT dishId, dishName, dishDescription, dishImage, townId FROM AD_DISHES WHERE townId = %s", (town_id,))
-		return [Dish(dishId=dish[0], dishName=dish[1], dishDescription=dish[2], dishImage=dish[3], townId=dish[4]) for dish in dishes]
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=str(e))
+async def get_town_dishes(town_id: int, request: Request, fields: Optional[str] = None, view: Optional[str] = Query(None, pattern="^(compact|full)$")):
+	projection = parse_fields("dishes", fields, view)
+	async def load():
+		try:
+			return await fetch_subresource("dishes", town_id, projection)
+		except Exception as e:
+			raise HTTPException(status_code=500, detail=str(e))
+
+	return await catalog_response(request, load, [f"dishes-{town_id}"])
 
 @TownsRouter.post("/towns/{town_id}/dishes", response_model=Dish)
 async def create_town_dish(town_id: int, dish: DishCreate, request: Request):
 	try:
-		new_dish_id = MySQL.GetLastID("AD_DISHES", "dishId") + 1
-		MySQL.AddItem(
+		new_dish_id = await AsyncMySQL.AddItem(
 			"AD_DISHES",
-			["dishId", "dishName", "dishDescription", "dishImage", "townId"],
-			[new_dish_id, dish.dishName, dish.dishDescription, dish.dishImage, town_id]
+			["dishName", "dishDescription", "dishImage", "townId"],
+			[dish.dishName, dish.dishDescription, dish.dishImage, town_id]
 		)
-		
+		invalidate_catalog(town_id, "dishes")
+		index_items("dish", [{"dishId": new_dish_id, "townId": town_id, **dish.dict()}])
+
+		await ChangeFeed.Record("dish", "upsert", [(new_dish_id, town_id)])
 		await log_action(town_id, IP.Extract(request), "Dish created", "create_dish")
 
 		return {"dishId": new_dish_id, "dishName": dish.dishName, "dishDescription": dish.dishDescription, "dishImage": dish.dishImage, "townId": town_id}
@@ -195,14 +615,31 @@ async def create_town_dish(town_id: int, dish: DishCreate, request: Request):
 		print(e)
 		raise HTTPException(status_code=500, detail=str(e))
 
+@TownsRouter.post("/towns/{town_id}/dishes/bulk", response_model=dict)
+async def create_town_dishes_bulk(town_id: int, request: Request):
+	try:
+		outcome = await bulk_create(request, DishCreate, "AD_DISHES", "dishId", town_id)
+		if not isinstance(outcome, fastapi.responses.JSONResponse) and outcome[1]:
+			invalidate_catalog(town_id, "dishes")
+			index_items("dish", outcome[1])
+			await ChangeFeed.Record("dish", "upsert", [(item["dishId"], town_id) for item in outcome[1]])
+			await log_action(town_id, IP.Extract(request), f"{len(outcome[1])} dishes created", "create_dish_bulk")
+		return bulk_response(outcome, "dishes")
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=str(e))
+
 @TownsRouter.delete("/towns/{town_id}/dishes/{dish_id}", response_model=dict)
 async def delete_town_dish(town_id: int, dish_id: int, request: Request):
 	try:
-		if not MySQL.ValueExists("AD_DISHES", "dishId", dish_id):
+		owner = await AsyncMySQL.FetchOne("SELECT townId FROM AD_DISHES WHERE dishId = %s", (dish_id,))
+		if not owner:
 			raise HTTPException(status_code=404, detail="Dish not found")
 
-		MySQL.Delete("AD_DISHES", "dishId", dish_id)
+		await AsyncMySQL.Delete("AD_DISHES", "dishId", dish_id)
+		invalidate_catalog(owner[0], "dishes")
+		unindex_item("dish", dish_id)
 
+		await ChangeFeed.Record("dish", "delete", [(dish_id, owner[0])])
 		await log_action(town_id, IP.Extract(request), "Dish deleted", "delete_dish")
 			
 		return {"status": "success", "message": "Dish deleted successfully"}
@@ -210,37 +647,59 @@ async def delete_town_dish(town_id: int, dish_id: int, request: Request):
 		raise HTTPException(status_code=500, detail=str(e))
 
 @TownsRouter.get("/towns/{town_id}/monuments", response_model=List[Monument])
-async def get_town_monuments(town_id: int):
-	try:
-		monuments = MySQL.FetchAll("SELECT monumentId, monumentName, monumentDescription, monumentImage, townId FROM AD_MONUMENTS WHERE townId = %s", (town_id,))
-		return [Monument(monumentId=monument[0], monumentName=monument[1], monumentDescription=monument[2], monumentImage=monument[3], townId=monument[4]) for monument in monuments]
-	except Exception as e:
-		raise HTTPException(status_code=500, detail=str(e))
+async def get_town_monuments(town_id: int, request: Request, fields: Optional[str] = None, view: Optional[str] = Query(None, pattern="^(compact|full)$")):
+	projection = parse_fields("monuments", fields, view)
+	async def load():
+		try:
+			return await fetch_subresource("monuments", town_id, projection)
+		except Exception as e:
+			raise HTTPException(status_code=500, detail=str(e))
+
+	return await catalog_response(request, load, [f"monuments-{town_id}"])
 
 @TownsRouter.post("/towns/{town_id}/monuments", response_model=Monument)
 async def create_town_monument(town_id: int, monument: MonumentCreate, request: Request):
 	try:
-		new_monument_id = MySQL.GetLastID("AD_MONUMENTS", "monumentId") + 1
-		MySQL.AddItem(
+		new_monument_id = await AsyncMySQL.AddItem(
 			"AD_MONUMENTS",
-			["monumentId", "monumentName", "monumentDescription", "monumentImage", "townId"],
-			[new_monument_id, monument.monumentName, monument.monumentDescription, monument.monumentImage, town_id]
+			["monumentName", "monumentDescription", "monumentImage", "townId"],
+			[monument.monumentName, monument.monumentDescription, monument.monumentImage, town_id]
 		)
+		invalidate_catalog(town_id, "monuments")
+		index_items("monument", [{"monumentId": new_monument_id, "townId": town_id, **monument.dict()}])
 
+		await ChangeFeed.Record("monument", "upsert", [(new_monument_id, town_id)])
 		await log_action(town_id, IP.Extract(request), "Monument created", "create_monument")
 
 		return {"monumentId": new_monument_id, "monumentName": monument.monumentName, "monumentDescription": monument.monumentDescription, "monumentImage": monument.monumentImage, "townId": town_id}
 	except Exception as e:
 		raise HTTPException(status_code=500, detail=str(e))
 
+@TownsRouter.post("/towns/{town_id}/monuments/bulk", response_model=dict)
+async def create_town_monuments_bulk(town_id: int, request: Request):
+	try:
+		outcome = await bulk_create(request, MonumentCreate, "AD_MONUMENTS", "monumentId", town_id)
+		if not isinstance(outcome, fastapi.responses.JSONResponse) and outcome[1]:
+			invalidate_catalog(town_id, "monuments")
+			index_items("monument", outcome[1])
+			await ChangeFeed.Record("monument", "upsert", [(item["monumentId"], town_id) for item in outcome[1]])
+			await log_action(town_id, IP.Extract(request), f"{len(outcome[1])} monuments created", "create_monument_bulk")
+		return bulk_response(outcome, "monuments")
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=str(e))
+
 @TownsRouter.delete("/towns/{town_id}/monuments/{monument_id}", response_model=dict)
 async def delete_town_monument(town_id: int, monument_id: int, request: Request):
 	try:
-		if not MySQL.ValueExists("AD_MONUMENTS", "monumentId", monument_id):
+		owner = await AsyncMySQL.FetchOne("SELECT townId FROM AD_MONUMENTS WHERE monumentId = %s", (monument_id,))
+		if not owner:
 			raise HTTPException(status_code=404, detail="Monument not found")
 
-		MySQL.Delete("AD_MONUMENTS", "monumentId", monument_id)
+		await AsyncMySQL.Delete("AD_MONUMENTS", "monumentId", monument_id)
+		invalidate_catalog(owner[0], "monuments")
+		unindex_item("monument", monument_id)
 
+		await ChangeFeed.Record("monument", "delete", [(monument_id, owner[0])])
 		await log_action(town_id, IP.Extract(request), "Monument deleted", "delete_monument")
 			
 		return {"status": "success", "message": "Monument deleted successfully"}
@@ -248,40 +707,60 @@ async def delete_town_monument(town_id: int, monument_id: int, request: Request)
 		raise HTTPException(status_code=500, detail=str(e))
 
 @TownsRouter.get("/towns/{town_id}/events", response_model=List[Event])
-async def get_town_events(town_id: int):
-	try:
-		events = MySQL.FetchAll("SELECT eventId, eventName, DATE_FORMAT(eventDate, '%Y-%m-%d') as eventDate, eventDescription, townId FROM AD_EVENTS WHERE townId = %s", (town_id,))
-		if not events:
-			raise HTTPException(status_code=404, detail="No events found for this town")
-		return [Event(eventId=event[0], eventName=event[1], eventDate=event[2], eventDescription=event[3], townId=event[4]) for event in events]
-	except Exception as e:
-		print("Error fetching events:", str(e))
-		raise HTTPException(status_code=500, detail="Internal server error while fetching events")
+async def get_town_events(town_id: int, request: Request, fields: Optional[str] = None, view: Optional[str] = Query(None, pattern="^(compact|full)$")):
+	projection = parse_fields("events", fields, view)
+	async def load():
+		try:
+			return await fetch_subresource("events", town_id, projection)
+		except Exception as e:
+			print("Error fetching events:", str(e))
+			raise HTTPException(status_code=500, detail="Internal server error while fetching events")
+
+	return await catalog_response(request, load, [f"events-{town_id}"])
 
 @TownsRouter.post("/towns/{town_id}/events", response_model=Event)
 async def create_town_event(town_id: int, event: EventCreate, request: Request):
 	try:
-		new_event_id = MySQL.GetLastID("AD_EVENTS", "eventId") + 1
-		MySQL.AddItem(
+		new_event_id = await AsyncMySQL.AddItem(
 			"AD_EVENTS",
-			["eventId", "eventName", "eventDate", "eventDescription", "townId"],
-			[new_event_id, event.eventName, event.eventDate, event.eventDescription, town_id]
+			["eventName", "eventDate", "eventDescription", "townId"],
+			[event.eventName, event.eventDate, event.eventDescription, town_id]
 		)
+		invalidate_catalog(town_id, "events")
+		index_items("event", [{"eventId": new_event_id, "townId": town_id, **event.dict()}])
 
+		await ChangeFeed.Record("event", "upsert", [(new_event_id, town_id)])
 		await log_action(town_id, IP.Extract(request), "Event created", "create_event")
 
 		return {"eventId": new_event_id, "eventName": event.eventName, "eventDate": event.eventDate, "eventDescription": event.eventDescription, "townId": town_id}
 	except Exception as e:
 		raise HTTPException(status_code=500, detail=str(e))
 
+@TownsRouter.post("/towns/{town_id}/events/bulk", response_model=dict)
+async def create_town_events_bulk(town_id: int, request: Request):
+	try:
+		outcome = await bulk_create(request, EventCreate, "AD_EVENTS", "eventId", town_id)
+		if not isinstance(outcome, fastapi.responses.JSONResponse) and outcome[1]:
+			invalidate_catalog(town_id, "events")
+			index_items("event", outcome[1])
+			await ChangeFeed.Record("event", "upsert", [(item["eventId"], town_id) for item in outcome[1]])
+			await log_action(town_id, IP.Extract(request), f"{len(outcome[1])} events created", "create_event_bulk")
+		return bulk_response(outcome, "events")
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=str(e))
+
 @TownsRouter.delete("/towns/{town_id}/events/{event_id}", response_model=dict)
 async def delete_town_event(town_id: int, event_id: int, request: Request):
 	try:
-		if not MySQL.ValueExists("AD_EVENTS", "eventId", event_id):
+		owner = await AsyncMySQL.FetchOne("SELECT townId FROM AD_EVENTS WHERE eventId = %s", (event_id,))
+		if not owner:
 			raise HTTPException(status_code=404, detail="Event not found")
 
-		MySQL.Delete("AD_EVENTS", "eventId", event_id)
+		await AsyncMySQL.Delete("AD_EVENTS", "eventId", event_id)
+		invalidate_catalog(owner[0], "events")
+		unindex_item("event", event_id)
 
+		await ChangeFeed.Record("event", "delete", [(event_id, owner[0])])
 		await log_action(town_id, IP.Extract(request), "Event deleted", "delete_event")
 			
 		return {"status": "success", "message": "Event deleted successfully"}
@@ -1,28 +1,63 @@
 import jwt as jwt_module
 from datetime import datetime, timedelta
 import secrets
+import time
+from utils.cache import LRUCache
+from utils.files import Registry
 
 def generate_secret_key(length=32):
     return secrets.token_hex(length // 2)
 
-# Ejemplo de uso
-SECRET_KEY = generate_secret_key()
-print("SECRET_KEY generada:", SECRET_KEY)
+# Las claves de firma salen de "jwt" en config.json: {"active": "kid", "keys": {"kid": "secreto", ...}}.
+# Se firma con la activa y se aceptan todas las de "keys", así se puede rotar añadiendo una nueva, activándola
+# y quitando la vieja cuando caduquen sus tokens. Todos los workers/nodos comparten las mismas claves.
+# Sin "jwt" en la config se genera una clave por proceso (solo sirve para desarrollo con un único worker).
+FALLBACK_KID = "local"
+FALLBACK_KEY = generate_secret_key()
+MIN_KEY_BYTES = 32
+PLACEHOLDER_KEYS = {"JWT-SECRET", "SECRET", "CHANGEME"}
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+def signing_keys():
+    jwt_config = Registry.Get("config.json").get("jwt")
+    if not jwt_config or not jwt_config.get("keys"):
+        return FALLBACK_KID, {FALLBACK_KID: FALLBACK_KEY}
+    # una clave de ejemplo o corta permite a cualquiera firmar tokens de admin: mejor no arrancar (ni firmar) que aceptarla
+    for kid, key in jwt_config["keys"].items():
+        if key.upper() in PLACEHOLDER_KEYS or len(key.encode("utf-8")) < MIN_KEY_BYTES:
+            raise RuntimeError(f"jwt.keys[{kid!r}] es un valor de ejemplo o tiene menos de {MIN_KEY_BYTES} bytes: genera uno con secrets.token_hex(32)")
+    return jwt_config.get("active", next(iter(jwt_config["keys"]))), jwt_config["keys"]
+
+if signing_keys()[0] == FALLBACK_KID:
+    print("jwt.keys no está configurado en config.json: usando una SECRET_KEY generada para este proceso")
+
+# tokens ya verificados: token -> payload, cada uno caduca a la vez que su "exp"
+verified_tokens = LRUCache(Size=Registry.Get("config.json").get("jwt", {}).get("cache_size", 4096), TTL=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 def create_access_token(data: dict):
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     data.update({"exp": expire})
-    encoded_jwt = jwt_module.encode(data, SECRET_KEY, algorithm=ALGORITHM)
+    kid, keys = signing_keys()
+    encoded_jwt = jwt_module.encode(data, keys[kid], algorithm=ALGORITHM, headers={"kid": kid})
     return encoded_jwt
 
 def decode_access_token(token: str):
+    # la versión de config.json va en la clave: si se retira una clave de firma, sus tokens dejan de valer al momento
+    cache_key = (Registry.Version("config.json"), token)
+    payload = verified_tokens.Get(cache_key)
+    if payload is not None and payload["exp"] > time.time():
+        return dict(payload)
     try:
-        payload = jwt_module.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        kid, keys = signing_keys()
+        key = keys.get(jwt_module.get_unverified_header(token).get("kid", kid))
+        if key is None:
+            return None  # clave desconocida o retirada
+        payload = jwt_module.decode(token, key, algorithms=[ALGORITHM], options={"require": ["exp"]})
     except jwt_module.ExpiredSignatureError:
         return None  # Token expirado
     except jwt_module.InvalidTokenError:
         return None  # Token inválido
+    verified_tokens.Set(cache_key, payload, TTL=payload["exp"] - time.time())
+    return dict(payload)
@@ -3,36 +3,60 @@
 # uvicorn main:AndaluciaDescubreAPI --host 0.0.0.0 --port 44444
 # screen -S AndaluciaDescubreAPI uvicorn main:AndaluciaDescubreAPI --host 0.0.0.0 --port 44444
 
-import fastapi
-from utils.files import JSON
-from utils.security import IP
-from utils.easify import APILoader, GetMSG
+import fastapi, signal
+from utils.files import Registry
+from utils.httpcache import HTTPCache
+from utils.audit import AuditLog
+from utils.database import AsyncMySQL
+from utils.mail import Mailer
+from utils.metrics import Metrics, MetricsMiddleware
+from utils.ratelimit import RateLimitMiddleware, RateLimits
+from utils.security import CaptchaVerifier, IP
+from utils.easify import APIMiddleware, GetMSG
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import errors, Limiter, _rate_limit_exceeded_handler
 
-Config : dict = JSON.Read("config.json")
+Config : dict = Registry.Get("config.json")
 
 AndaluciaDescubreAPI = fastapi.FastAPI(
 	title = "Andalucia Descubre's API",
 	version = "BETA 1.0"
 )
 
-APILimiter = Limiter(key_func = IP.Extract)
-AndaluciaDescubreAPI.state.limiter = APILimiter
-AndaluciaDescubreAPI.add_exception_handler(errors.RateLimitExceeded, _rate_limit_exceeded_handler)
+if hasattr(signal, "SIGHUP"): signal.signal(signal.SIGHUP, lambda Signal, Frame: Registry.Reload()) # kill -HUP recarga config.json, routes.json y messages.json
+
+AndaluciaDescubreAPI.add_middleware(RateLimitMiddleware)
+AndaluciaDescubreAPI.add_middleware(APIMiddleware)
 AndaluciaDescubreAPI.add_middleware(CORSMiddleware, allow_origins = Config["cors"], allow_credentials = True, allow_headers = ["*"], allow_methods = ["*"])
+AndaluciaDescubreAPI.add_middleware(MetricsMiddleware) # el último que se añade es el más externo, así la latencia incluye a los demás middlewares
 
 from endpoints.auth import AuthRouter
 from endpoints.towns import TownsRouter
 AndaluciaDescubreAPI.include_router(AuthRouter, prefix = "/auth")
 AndaluciaDescubreAPI.include_router(TownsRouter, prefix="/api")
 
+@AndaluciaDescubreAPI.on_event("startup")
+async def Startup():
+	AuditLog.Start()
+	RateLimits.Current() # crea el backend al arrancar para avisar ya de una configuración que no sirve con varios workers
+
+@AndaluciaDescubreAPI.on_event("shutdown")
+async def Shutdown():
+	await AuditLog.Stop()
+	await CaptchaVerifier.Close()
+	await Mailer.Stop()
+	await RateLimits.Close()
+	await HTTPCache.Close()
+	AsyncMySQL.Shutdown()
+
 @AndaluciaDescubreAPI.get("/", include_in_schema = True)
 async def MainRoute(request: fastapi.Request):
-	APIData = APILoader("/", request)
-	if APIData != True: return APIData
 	return {"andalucia_descubre_debug_your_ip": IP.Extract(request)}
 
+@AndaluciaDescubreAPI.get("/metrics", include_in_schema = False)
+async def MetricsRoute(request: fastapi.Request):
+	if not Metrics.Allowed(request): return fastapi.responses.JSONResponse(status_code = 403, content = {"status": 403, "message": GetMSG("api.not_whitelisted")})
+	return fastapi.responses.PlainTextResponse(Metrics.Render(), media_type = "text/plain; version=0.0.4")
+
 @AndaluciaDescubreAPI.get("/favicon.ico", include_in_schema = False)
 async def Favicon(request: fastapi.Request): return fastapi.responses.FileResponse("database/favicon.ico")
 
@@ -44,10 +68,6 @@ async def Error404(request: fastapi.Request, Error: fastapi.HTTPException):
 async def Error405(request: fastapi.Request, Error: fastapi.HTTPException):
 	return fastapi.responses.JSONResponse(status_code = 405, content = {"status": 405, "message": GetMSG("error.405")})
 
-@AndaluciaDescubreAPI.exception_handler(429)
-async def Error429(request: fastapi.Request, Error: fastapi.HTTPException):
-	return fastapi.responses.JSONResponse(status_code = 429, content = {"status": 429, "message": GetMSG("error.429").format(Error.detail.split(" per")[0], Error.detail.split(" per ")[1])})
-
 @AndaluciaDescubreAPI.exception_handler(500)
 async def Error500(request: fastapi.Request, Error: fastapi.HTTPException):
 	return fastapi.responses.JSONResponse(status_code = 500, content = {"status": 500, "message": GetMSG("error.500")})
\ No newline at end of file
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, collections
+from utils.database import AsyncMySQL
+from utils.easify import Now
+from utils.files import Registry
+
+class AuditLog(): # cola de AD_LOGS que un worker vuelca por lotes; al llenarse se aplica `overflow`
+
+	Batch : list = []
+	Columns = ["userID", "userIP", "logDate", "description", "type"]
+	Counters = collections.Counter()
+	Flushing : asyncio.Task = None
+	Queue : asyncio.Queue = None
+	Worker : asyncio.Task = None
+
+	def Enqueue(Record : tuple) -> bool:
+		if AuditLog.Worker is None: AuditLog.Start()
+		try:
+			AuditLog.Queue.put_nowait(Record)
+		except asyncio.QueueFull:
+			if AuditLog.Settings()["overflow"] != "drop_oldest":
+				AuditLog.Counters["dropped"] += 1
+				return False
+			AuditLog.Queue.get_nowait()
+			AuditLog.Queue.put_nowait(Record)
+			AuditLog.Counters["dropped"] += 1
+		AuditLog.Counters["queued"] += 1
+		return True
+
+	def Error(Endpoint : str, UserID, UserIP : str, LogDate : int, Error, Type : str) -> bool:
+		# nunca lanza ni bloquea
+		try: return AuditLog.Enqueue((UserID, UserIP, LogDate, f"{Endpoint}: {Error}", Type))
+		except Exception: return False
+
+	async def Flush(Records : list):
+		try:
+			await AsyncMySQL.AddItems("AD_LOGS", AuditLog.Columns, Records, ReturnIDs = False)
+			AuditLog.Counters["written"] += len(Records)
+			AuditLog.Counters["flushes"] += 1
+		except Exception as Error:
+			AuditLog.Counters["failed"] += len(Records)
+			print(f"Error writing {len(Records)} audit records: {Error}")
+
+	async def Log(UserID, UserIP : str, Description : str, Type : str, LogDate : int = None) -> bool:
+		Record = (UserID, UserIP, Now() if LogDate is None else LogDate, Description, Type)
+		if AuditLog.Settings()["overflow"] == "block":
+			if AuditLog.Worker is None: AuditLog.Start()
+			await AuditLog.Queue.put(Record)
+			AuditLog.Counters["queued"] += 1
+			return True
+		return AuditLog.Enqueue(Record)
+
+	async def Run():
+		Settings = AuditLog.Settings()
+		Loop = asyncio.get_running_loop()
+		while True:
+			AuditLog.Batch.append(await AuditLog.Queue.get())
+			Deadline = Loop.time() + Settings["flush_interval"]
+			while len(AuditLog.Batch) < Settings["batch_size"]:
+				if not AuditLog.Queue.empty():
+					AuditLog.Batch.append(AuditLog.Queue.get_nowait())
+					continue
+				Remaining = Deadline - Loop.time()
+				if Remaining <= 0: break
+				try: AuditLog.Batch.append(await asyncio.wait_for(AuditLog.Queue.get(), Remaining))
+				except asyncio.TimeoutError: break
+			# shield: si se cancela el worker al apagar, el volcado en curso termina igualmente
+			Records, AuditLog.Batch = AuditLog.Batch, []
+			AuditLog.Flushing = asyncio.ensure_future(AuditLog.Flush(Records))
+			await asyncio.shield(AuditLog.Flushing)
+
+	def Settings() -> dict:
+		return {"queue_size": 10000, "batch_size": 200, "flush_interval": 1.0, "overflow": "drop_oldest", **Registry.Get("config.json").get("audit", {})}
+
+	def Start():
+		if AuditLog.Worker is not None: return
+		AuditLog.Queue = asyncio.Queue(maxsize = AuditLog.Settings()["queue_size"])
+		AuditLog.Worker = asyncio.get_running_loop().create_task(AuditLog.Run())
+
+	def Stats() -> dict:
+		return {"pending": len(AuditLog.Batch) + (AuditLog.Queue.qsize() if AuditLog.Queue else 0), "queued": AuditLog.Counters["queued"], "written": AuditLog.Counters["written"],
+				"flushes": AuditLog.Counters["flushes"], "dropped": AuditLog.Counters["dropped"], "failed": AuditLog.Counters["failed"]}
+
+	async def Stop():
+		if AuditLog.Worker is None: return
+		AuditLog.Worker.cancel()
+		try: await AuditLog.Worker
+		except asyncio.CancelledError: pass
+		if AuditLog.Flushing is not None: await AuditLog.Flushing
+		Records, AuditLog.Batch = AuditLog.Batch, []
+		while not AuditLog.Queue.empty(): Records.append(AuditLog.Queue.get_nowait())
+		BatchSize = AuditLog.Settings()["batch_size"]
+		for Index in range(0, len(Records), BatchSize): await AuditLog.Flush(Records[Index:Index + BatchSize])
+		AuditLog.Worker = AuditLog.Flushing = AuditLog.Queue = None
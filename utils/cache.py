@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, collections, threading, time
+from utils.files import Registry
+
+class LRUCache(): # LRU con TTL por entrada; cada invalidación sube la generación para que una lectura vieja no se guarde
+
+	def __init__(self, Size : int = 1024, TTL : float = 300):
+		self.Size = Size
+		self.TTL = TTL
+		self.Items = collections.OrderedDict()
+		self.Lock = threading.Lock()
+		self.Generation = 0
+		self.Loading = {}
+		self.Counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+	def Get(self, Key, Default = None):
+		with self.Lock:
+			Item = self.Items.get(Key)
+			if Item is None:
+				self.Counters["misses"] += 1
+				return Default
+			if Item[0] <= time.monotonic():
+				del self.Items[Key]
+				self.Counters["expirations"] += 1
+				self.Counters["misses"] += 1
+				return Default
+			self.Items.move_to_end(Key)
+			self.Counters["hits"] += 1
+			return Item[1]
+
+	def Set(self, Key, Value, TTL : float = None, Generation : int = None):
+		with self.Lock:
+			if Generation is not None and Generation != self.Generation: return
+			self.Items[Key] = (time.monotonic() + (self.TTL if TTL is None else TTL), Value)
+			self.Items.move_to_end(Key)
+			while len(self.Items) > self.Size:
+				self.Items.popitem(last = False)
+				self.Counters["evictions"] += 1
+
+	async def Fetch(self, Key, Loader, TTL : float = None):
+		# una sola carga por clave aunque lleguen muchas peticiones a la vez
+		Missing = object()
+		Value = self.Get(Key, Missing)
+		if Value is not Missing: return Value
+		if Key in self.Loading: return await asyncio.shield(self.Loading[Key])
+		Generation = self.Generation
+		Future = asyncio.get_running_loop().create_future()
+		self.Loading[Key] = Future
+		try:
+			Value = await Loader()
+			if Value is not None: self.Set(Key, Value, TTL, Generation)
+			Future.set_result(Value)
+			return Value
+		except BaseException as Error:
+			Future.set_exception(Error)
+			Future.exception() # marcada como leída para que asyncio no avise si nadie más la estaba esperando
+			raise
+		finally:
+			self.Loading.pop(Key, None)
+
+	def Invalidate(self, *Prefix):
+		# recorre la caché entera, pero solo pasa en escrituras
+		with self.Lock:
+			self.Generation += 1
+			Keys = [Key for Key in self.Items if Key[:len(Prefix)] == Prefix]
+			for Key in Keys: del self.Items[Key]
+			self.Counters["invalidations"] += len(Keys)
+
+	def Clear(self):
+		with self.Lock:
+			self.Generation += 1
+			self.Items.clear()
+
+	def Stats(self) -> dict:
+		with self.Lock:
+			Stats = {"size": self.Size, "items": len(self.Items), "ttl": self.TTL, **self.Counters}
+		Lookups = Stats["hits"] + Stats["misses"]
+		Stats["hit_ratio"] = Stats["hits"] / Lookups if Lookups else 0.0
+		return Stats
+
+class Reloader(): # recarga entera cada `ttl` de catalog_cache; si alguien escribe mientras se carga, la siguiente llamada recarga
+
+	Instances : list = []
+
+	def __init__(self):
+		self.Loaded = None
+		self.Lock = None
+		self.Stale = False
+		Reloader.Instances.append(self)
+
+	def Fresh(self) -> bool:
+		return self.Loaded is not None and time.monotonic() - self.Loaded < Registry.Get("config.json").get("catalog_cache", {}).get("ttl", 300)
+
+	async def Ensure(self, Load):
+		if self.Fresh(): return
+		if self.Lock is None: self.Lock = asyncio.Lock()
+		async with self.Lock:
+			if self.Fresh(): return
+			self.Stale = False
+			await Load()
+			self.Loaded = None if self.Stale else time.monotonic()
+
+	def Touch(self):
+		if self.Lock is not None and self.Lock.locked(): self.Stale = True
+
+	def Age(self) -> float: return None if self.Loaded is None else time.monotonic() - self.Loaded
+
+	def Expire(self):
+		self.Loaded = None
+		self.Touch()
+
+CatalogCFG : dict = Registry.Get("config.json").get("catalog_cache", {})
+CatalogCache = LRUCache(Size = CatalogCFG.get("size", 2048), TTL = CatalogCFG.get("ttl", 300))
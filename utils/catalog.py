@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import bisect, datetime, math, random
+from utils.cache import Reloader
+from utils.database import AsyncMySQL
+from utils.search import InvertedIndex
+
+class IDIndex(): # lista de IDs más la posición de cada uno; con semilla se muestrea sobre una copia ordenada para que dé lo mismo en todos los workers
+
+	def __init__(self):
+		self.IDs = []
+		self.Positions = {}
+		self.Sorted = None
+
+	def __len__(self): return len(self.IDs)
+
+	def Add(self, ID):
+		if ID in self.Positions: return
+		self.Sorted = None
+		self.Positions[ID] = len(self.IDs)
+		self.IDs.append(ID)
+
+	def Remove(self, ID):
+		Position = self.Positions.pop(ID, None)
+		if Position is None: return
+		self.Sorted = None
+		Last = self.IDs.pop()
+		if Position < len(self.IDs):
+			self.IDs[Position] = Last
+			self.Positions[Last] = Position
+
+	def Replace(self, IDs):
+		self.IDs = list(dict.fromkeys(IDs))
+		self.Sorted = None
+		self.Positions = {ID: Position for Position, ID in enumerate(self.IDs)}
+
+	def Sample(self, Count : int, Seed = None) -> list:
+		Count = max(0, min(Count, len(self.IDs)))
+		if Seed is None: return random.sample(self.IDs, Count)
+		if self.Sorted is None: self.Sorted = sorted(self.IDs)
+		return random.Random(Seed).sample(self.Sorted, Count)
+
+class VisibleTowns(): # IDs de los pueblos visibles, para sacar pueblos aleatorios sin ORDER BY RAND()
+
+	Index = IDIndex()
+	Reload = Reloader()
+
+	def Add(TownID : int):
+		VisibleTowns.Reload.Touch()
+		if VisibleTowns.Reload.Loaded is not None: VisibleTowns.Index.Add(TownID)
+
+	async def Ensure(): await VisibleTowns.Reload.Ensure(VisibleTowns.Load)
+
+	async def Load():
+		Rows = await AsyncMySQL.FetchAll("SELECT townId FROM AD_TOWNS WHERE townVisibility = 1 ORDER BY townId")
+		VisibleTowns.Index.Replace(Row[0] for Row in Rows)
+
+	def Remove(TownID : int):
+		VisibleTowns.Reload.Touch()
+		VisibleTowns.Index.Remove(TownID)
+
+	async def Sample(Count : int, Seed = None) -> list:
+		await VisibleTowns.Ensure()
+		return VisibleTowns.Index.Sample(Count, Seed)
+
+	def Set(TownID : int, Visible : bool):
+		if Visible: VisibleTowns.Add(TownID)
+		else: VisibleTowns.Remove(TownID)
+
+	def Stats() -> dict: return {"visible_towns": len(VisibleTowns.Index), "loaded_ago": VisibleTowns.Reload.Age()}
+
+class DateIndex(): # listas ordenadas de (fecha, ID) por cubo: un rango de fechas es un bisect y un slice
+
+	def __init__(self): self.Keys = {}
+
+	def Add(self, Buckets, Key):
+		for Bucket in Buckets: bisect.insort(self.Keys.setdefault(Bucket, []), Key)
+
+	def Remove(self, Buckets, Key):
+		for Bucket in Buckets:
+			Keys = self.Keys.get(Bucket)
+			if not Keys: continue
+			Position = bisect.bisect_left(Keys, Key)
+			if Position < len(Keys) and Keys[Position] == Key: del Keys[Position]
+			if not Keys: del self.Keys[Bucket]
+
+	def Range(self, Bucket, From : str = None, To : str = None, After = None, Limit : int = 100) -> list:
+		# From <= fecha <= To, a partir de la siguiente a After
+		Keys = self.Keys.get(Bucket, [])
+		Start = bisect.bisect_left(Keys, (From,)) if From else 0
+		if After is not None: Start = max(Start, bisect.bisect_right(Keys, After))
+		End = bisect.bisect_right(Keys, (To, math.inf)) if To else len(Keys)
+		return Keys[Start:min(End, Start + Limit)]
+
+class EventCalendar(): # agenda de eventos por fecha; los eventos sin fecha o de localidades ocultas no entran
+
+	ByTown : dict = {}
+	Events : dict = {}
+	Index = DateIndex()
+	Reload = Reloader()
+	Towns : dict = {}
+
+	Queries = [
+		("SELECT eventId, eventName, DATE_FORMAT(eventDate, '%Y-%m-%d') as eventDate, eventDescription, townId FROM AD_EVENTS", None),
+		("SELECT townId, townProvince, townVisibility FROM AD_TOWNS", None)
+	]
+
+	def Date(Value) -> str:
+		# 'YYYY-MM-DD' o None
+		if Value is None: return None
+		try: return datetime.date.fromisoformat(str(Value)[:10]).isoformat()
+		except ValueError: return None
+
+	def Buckets(Row, Towns : dict) -> list:
+		Province, Visible = Towns.get(Row[4], (None, False))
+		if not Visible or EventCalendar.Date(Row[2]) is None: return []
+		return ["*", ("town", Row[4])] + ([("province", InvertedIndex.Fold(Province))] if Province else [])
+
+	def Insert(Index : DateIndex, Events : dict, ByTown : dict, Towns : dict, Row):
+		Row = (Row[0], Row[1], EventCalendar.Date(Row[2]) or Row[2], Row[3], Row[4])
+		Events[Row[0]] = Row
+		ByTown.setdefault(Row[4], set()).add(Row[0])
+		Index.Add(EventCalendar.Buckets(Row, Towns), (Row[2], Row[0]))
+
+	def Delete(EventID : int):
+		Row = EventCalendar.Events.pop(EventID, None)
+		if Row is None: return
+		EventCalendar.ByTown.get(Row[4], set()).discard(EventID)
+		EventCalendar.Index.Remove(EventCalendar.Buckets(Row, EventCalendar.Towns), (Row[2], Row[0]))
+
+	def Put(Row):
+		# Row = (eventId, eventName, eventDate, eventDescription, townId)
+		EventCalendar.Reload.Touch()
+		if EventCalendar.Reload.Loaded is None: return
+		EventCalendar.Delete(Row[0])
+		EventCalendar.Insert(EventCalendar.Index, EventCalendar.Events, EventCalendar.ByTown, EventCalendar.Towns, Row)
+
+	def Remove(EventID : int):
+		EventCalendar.Reload.Touch()
+		EventCalendar.Delete(EventID)
+
+	def SetTown(TownID : int, Province : str, Visible : bool):
+		# al cambiar la provincia o la visibilidad sus eventos cambian de cubo
+		EventCalendar.Reload.Touch()
+		if EventCalendar.Reload.Loaded is None: return
+		Rows = [EventCalendar.Events[EventID] for EventID in EventCalendar.ByTown.get(TownID, ())]
+		for Row in Rows: EventCalendar.Index.Remove(EventCalendar.Buckets(Row, EventCalendar.Towns), (Row[2], Row[0]))
+		EventCalendar.Towns[TownID] = (Province, bool(Visible))
+		for Row in Rows: EventCalendar.Index.Add(EventCalendar.Buckets(Row, EventCalendar.Towns), (Row[2], Row[0]))
+
+	def RemoveTown(TownID : int):
+		EventCalendar.Reload.Touch()
+		for EventID in list(EventCalendar.ByTown.pop(TownID, ())): EventCalendar.Delete(EventID)
+		EventCalendar.Towns.pop(TownID, None)
+
+	async def Ensure(): await EventCalendar.Reload.Ensure(EventCalendar.Load)
+
+	async def Load():
+		Rows, TownRows = await AsyncMySQL.FetchBatch(EventCalendar.Queries)
+		Index, Events, ByTown, Towns = DateIndex(), {}, {}, {TownID: (Province, bool(Visible)) for TownID, Province, Visible in TownRows}
+		for Row in Rows: EventCalendar.Insert(Index, Events, ByTown, Towns, Row)
+		EventCalendar.Index, EventCalendar.Events, EventCalendar.ByTown, EventCalendar.Towns = Index, Events, ByTown, Towns
+
+	async def Range(From : str = None, To : str = None, Province : str = None, TownID : int = None, After = None, Limit : int = 100):
+		# devuelve (filas, clave de la última o None si no hay más); TownID manda sobre Province
+		await EventCalendar.Ensure()
+		Bucket = ("town", TownID) if TownID is not None else ("province", InvertedIndex.Fold(Province)) if Province else "*"
+		Keys = EventCalendar.Index.Range(Bucket, From, To, After, Limit + 1)
+		Next = list(Keys[Limit - 1]) if len(Keys) > Limit else None
+		return [EventCalendar.Events[EventID] for _, EventID in Keys[:Limit]], Next
+
+	def Stats() -> dict:
+		return {"events": len(EventCalendar.Events), "dated_events": len(EventCalendar.Index.Keys.get("*", [])), "loaded_ago": EventCalendar.Reload.Age()}
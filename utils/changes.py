@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from utils.audit import AuditLog
+from utils.database import AsyncMySQL
+from utils.easify import Now
+from utils.files import Registry
+
+class ChangeFeed(): # AD_CHANGES: changeID es el cursor; Read() espera `settle` segundos para no saltarse un INSERT que confirme tarde
+
+	Columns = ["resource", "resourceID", "townId", "action"]
+
+	def Settings() -> dict: return {"settle": 2, **Registry.Get("config.json").get("changes", {})}
+
+	async def Record(Resource : str, Action : str, Items : list) -> bool:
+		# Items = [(ID, townId), ...]; si falla se anota en AD_LOGS pero la escritura ya está hecha
+		try:
+			await AsyncMySQL.AddItems("AD_CHANGES", ChangeFeed.Columns, [(Resource, ID, TownID, Action) for ID, TownID in Items], ReturnIDs = False, Expressions = {"changeDate": "UNIX_TIMESTAMP()"})
+			return True
+		except Exception as Error:
+			AuditLog.Error("/changes", None, None, Now(), Error, "change_feed_error")
+			return False
+
+	async def Head() -> int:
+		# último changeID asentado
+		Row = await AsyncMySQL.FetchOne("SELECT COALESCE(MAX(changeID), 0) FROM AD_CHANGES WHERE changeDate <= UNIX_TIMESTAMP() - %s", (ChangeFeed.Settings()["settle"],))
+		return Row[0]
+
+	async def Latest() -> int:
+		# último changeID sin esperar a `settle`, la versión del catálogo para los ETag
+		Row = await AsyncMySQL.FetchOne("SELECT COALESCE(MAX(changeID), 0) FROM AD_CHANGES")
+		return Row[0]
+
+	async def Read(After : int, Limit : int):
+		# devuelve (filas posteriores a After, hay más)
+		Rows = await AsyncMySQL.FetchAll(
+			"SELECT changeID, resource, resourceID, townId, action FROM AD_CHANGES WHERE changeID > %s AND changeDate <= UNIX_TIMESTAMP() - %s ORDER BY changeID LIMIT %s",
+			(After, ChangeFeed.Settings()["settle"], Limit + 1)
+		)
+		return Rows[:Limit], len(Rows) > Limit
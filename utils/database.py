@@ -1,112 +1,425 @@
 # -*- coding: utf-8 -*-
 
-import contextlib, hashlib, mysql.connector
-from utils.files import JSON
+import asyncio, collections, concurrent.futures, contextlib, functools, mysql.connector, threading, time
+from utils.files import Registry
+from utils.metrics import Metrics
+
+class PoolTimeout(Exception): pass
+
+class TimedCursor(): # suma solo el tiempo de execute y los fetch, no el del código entre medias
+
+	def __init__(self, SQLCursor):
+		self.SQLCursor = SQLCursor
+		self.Statement = None
+
+	def __getattr__(self, Name): return getattr(self.SQLCursor, Name)
+
+	def Time(self, Method, *Args, **KWArgs):
+		Start = time.perf_counter()
+		try: return Method(*Args, **KWArgs)
+		finally: self.Elapsed += time.perf_counter() - Start
+
+	def Begin(self, Method, Query, *Args, **KWArgs):
+		self.Finish()
+		self.Statement, self.Elapsed, self.Rows = Metrics.Fingerprint(Query), 0.0, 0
+		try: Result = self.Time(Method, Query, *Args, **KWArgs)
+		except BaseException:
+			self.Finish(Failed = True)
+			raise
+		if not self.SQLCursor.with_rows: self.Finish()
+		return Result
+
+	def Finish(self, Failed : bool = False):
+		if self.Statement is None: return
+		Metrics.Query(self.Statement, self.Elapsed, self.Rows, Failed)
+		self.Statement = None
+
+	def execute(self, Query, *Args, **KWArgs): return self.Begin(self.SQLCursor.execute, Query, *Args, **KWArgs)
+
+	def executemany(self, Query, *Args, **KWArgs): return self.Begin(self.SQLCursor.executemany, Query, *Args, **KWArgs)
+
+	def fetchall(self):
+		SQLResults = self.Time(self.SQLCursor.fetchall)
+		self.Rows += len(SQLResults)
+		self.Finish()
+		return SQLResults
+
+	def fetchmany(self, *Args, **KWArgs):
+		SQLResults = self.Time(self.SQLCursor.fetchmany, *Args, **KWArgs)
+		if SQLResults: self.Rows += len(SQLResults)
+		else: self.Finish()
+		return SQLResults
+
+	def fetchone(self):
+		SQLResult = self.Time(self.SQLCursor.fetchone)
+		if SQLResult is None: self.Finish()
+		else: self.Rows += 1
+		return SQLResult
+
+	def close(self):
+		self.Finish()
+		return self.SQLCursor.close()
+
+class TimedConnection(): # igual que la conexión real pero con TimedCursor
+
+	def __init__(self, SQLConnection): self.SQLConnection = SQLConnection
+
+	def __getattr__(self, Name): return getattr(self.SQLConnection, Name)
+
+	def cursor(self, *Args, **KWArgs): return TimedCursor(self.SQLConnection.cursor(*Args, **KWArgs))
+
+class ConnectionPool(): # LIFO, ping si llevan `PingAfter` segundos paradas, recicladas a los `Recycle` segundos, PoolTimeout tras `Timeout`
+
+	def __init__(self, Settings : dict, Size : int = 10, Timeout : float = 10.0, Recycle : int = 1800, PingAfter : int = 30):
+		self.Settings = Settings
+		self.Size = Size
+		self.Timeout = Timeout
+		self.Recycle = Recycle
+		self.PingAfter = PingAfter
+		self.Condition = threading.Condition()
+		self.Idle = collections.deque()
+		self.Born = {}
+		self.Open = 0
+		self.InUse = 0
+		self.Counters = {"acquired": 0, "waits": 0, "timeouts": 0, "recycled": 0, "broken": 0, "unread": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+	def Acquire(self):
+		Start = time.perf_counter()
+		Deadline = Start + self.Timeout
+		Waited = False
+		with self.Condition:
+			while True:
+				if self.Idle:
+					SQLConnection, LastUsed = self.Idle.pop()
+					break
+				if self.Open < self.Size:
+					SQLConnection, LastUsed = None, None
+					self.Open += 1
+					break
+				Remaining = Deadline - time.perf_counter()
+				if Remaining <= 0:
+					self.Counters["timeouts"] += 1
+					raise PoolTimeout(f"No MySQL connection available after {self.Timeout}s ({self.Size} in use)")
+				Waited = True
+				self.Condition.wait(Remaining)
+			self.InUse += 1
+			self.Counters["acquired"] += 1
+			if Waited:
+				WaitTime = time.perf_counter() - Start
+				self.Counters["waits"] += 1
+				self.Counters["wait_time_total"] += WaitTime
+				self.Counters["wait_time_max"] = max(self.Counters["wait_time_max"], WaitTime)
+		try:
+			return self.Validate(SQLConnection, LastUsed)
+		except Exception:
+			self.Forget(None)
+			raise
+
+	def Validate(self, SQLConnection, LastUsed):
+		if SQLConnection is None: return self.Create()
+		Now = time.monotonic()
+		if Now - self.Born.get(id(SQLConnection), Now) > self.Recycle:
+			self.Counters["recycled"] += 1
+			self.Close(SQLConnection)
+			return self.Create()
+		if Now - LastUsed > self.PingAfter:
+			try: SQLConnection.ping(reconnect = False)
+			except Exception:
+				self.Counters["broken"] += 1
+				self.Close(SQLConnection)
+				return self.Create()
+		return SQLConnection
+
+	def Create(self):
+		SQLConnection = mysql.connector.connect(**self.Settings)
+		self.Born[id(SQLConnection)] = time.monotonic()
+		return SQLConnection
+
+	def Close(self, SQLConnection, Abort : bool = False):
+		self.Born.pop(id(SQLConnection), None)
+		if Abort:
+			try: return SQLConnection.shutdown() # cierra el socket sin QUIT, así no se leen antes las filas pendientes
+			except Exception: pass # la extensión C no implementa shutdown(): se cierra normal
+		with contextlib.suppress(Exception): SQLConnection.close()
+
+	def Forget(self, SQLConnection, Abort : bool = False):
+		if SQLConnection is not None: self.Close(SQLConnection, Abort)
+		with self.Condition:
+			self.Open -= 1
+			self.InUse -= 1
+			self.Condition.notify()
+
+	def Release(self, SQLConnection, Discard : bool = False):
+		Unread = False
+		if not Discard:
+			try:
+				Unread = SQLConnection.unread_result
+				if not Unread and SQLConnection.in_transaction: SQLConnection.rollback()
+			except Exception: Discard = True
+		if Unread:
+			# quedan filas sin leer (un Stream abandonado a medias): rollback() se las traería todas a memoria antes
+			# y sin él la conexión volvería al pool con "Unread result found", así que se descarta
+			self.Counters["unread"] += 1
+			return self.Forget(SQLConnection, Abort = True)
+		if Discard:
+			self.Counters["broken"] += 1
+			return self.Forget(SQLConnection)
+		with self.Condition:
+			self.Idle.append((SQLConnection, time.monotonic()))
+			self.InUse -= 1
+			self.Condition.notify()
+
+	@contextlib.contextmanager
+	def Borrow(self):
+		Start = time.perf_counter()
+		SQLConnection = self.Acquire()
+		Metrics.Acquired(time.perf_counter() - Start)
+		try: yield TimedConnection(SQLConnection) if Metrics.Enabled() else SQLConnection
+		except mysql.connector.errors.OperationalError:
+			self.Release(SQLConnection, Discard = True)
+			raise
+		except BaseException:
+			self.Release(SQLConnection)
+			raise
+		else: self.Release(SQLConnection)
+
+	def Stats(self) -> dict:
+		with self.Condition:
+			Stats = {"size": self.Size, "open": self.Open, "in_use": self.InUse, "idle": len(self.Idle), **self.Counters}
+		Stats["wait_time_avg"] = Stats["wait_time_total"] / Stats["waits"] if Stats["waits"] else 0.0
+		return Stats
+
+	def Shutdown(self):
+		with self.Condition:
+			while self.Idle:
+				SQLConnection, _ = self.Idle.pop()
+				self.Close(SQLConnection)
+				self.Open -= 1
+
+PoolLock = threading.Lock()
 
 class MySQL():
 
-	def AddItem(Table : str, Columns : list, Values):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		ColumnsSTR = ", ".join(Columns)
-		Placeholders = ", ".join(["%s"] * len(Values))
-		SQLCursor.execute(f"INSERT INTO {Table} ({ColumnsSTR}) VALUES ({Placeholders})", Values)
-		SQLConnection.commit()
-		SQLConnection.close()
+	Pool : ConnectionPool = None
+
+	def AddItem(Table : str, Columns : list, Values) -> int:
+		# devuelve el ID AUTO_INCREMENT sin consultas extra
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			ColumnsSTR = ", ".join(Columns)
+			Placeholders = ", ".join(["%s"] * len(Values))
+			SQLCursor.execute(f"INSERT INTO {Table} ({ColumnsSTR}) VALUES ({Placeholders})", Values)
+			SQLConnection.commit()
+			return SQLCursor.lastrowid
+
+	def AddItems(Table : str, Columns : list, Rows : list, ReturnIDs : bool = True, Expressions : dict = None) -> list:
+		# un INSERT multi-fila es un "simple insert" para InnoDB: sus IDs son consecutivos desde lastrowid
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			# Expressions = {"columna": "SQL"} se calcula en MySQL para cada fila (p. ej. {"changeDate": "UNIX_TIMESTAMP()"})
+			ColumnsSTR = ", ".join([*Columns, *(Expressions or {})])
+			Placeholders = ", ".join(["%s"] * len(Columns) + list((Expressions or {}).values()))
+			SQLCursor.executemany(f"INSERT INTO {Table} ({ColumnsSTR}) VALUES ({Placeholders})", Rows)
+			FirstID = SQLCursor.lastrowid
+			SQLConnection.commit()
+			if not ReturnIDs: return None
+			SQLCursor.execute("SELECT @@auto_increment_increment")
+			Increment = SQLCursor.fetchone()[0]
+		return [FirstID + Index * Increment for Index in range(len(Rows))]
 
-	def Connect() -> mysql.connector.connection.MySQLConnection:
-		Config : dict = JSON.Read("config.json")
-		return mysql.connector.connect(database = Config["mysql"]["database"], host = Config["mysql"]["host"], user = Config["mysql"]["user"], password = Config["mysql"]["password"])
+	def Borrow():
+		return MySQL.GetPool().Borrow()
 
 	def FetchAll(Query, Params = None):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(Query, Params)
-		SQLResults = SQLCursor.fetchall()
-		SQLConnection.close()
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLCursor.execute(Query, Params)
+			SQLResults = SQLCursor.fetchall()
 		return SQLResults
 	
+	def FetchBatch(Queries : list) -> list:
+		# varias consultas [(Query, Params), ...] sobre una sola conexión
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLResults = []
+			for Query, Params in Queries:
+				SQLCursor.execute(Query, Params)
+				SQLResults.append(SQLCursor.fetchall())
+		return SQLResults
+
 	def FetchOne(Query, Params=None):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(Query, Params)
-		SQLResult = SQLCursor.fetchone()
-		SQLConnection.close()
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLCursor.execute(Query, Params)
+			SQLResult = SQLCursor.fetchone()
+			SQLCursor.fetchall() # descarta el resto para que la conexión vuelva limpia al pool
 		return SQLResult
 
-	def GetLastID(Table : str, Row : str) -> int:
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(f"SELECT * FROM {Table} ORDER BY {Row} DESC LIMIT 1;")
-		SQLResult = SQLCursor.fetchone()[0]
-		SQLConnection.close()
-		return SQLResult
+	def GetPool() -> ConnectionPool:
+		if MySQL.Pool is not None: return MySQL.Pool
+		with PoolLock:
+			if MySQL.Pool is None:
+				Config : dict = Registry.Get("config.json")
+				PoolCFG : dict = Config["mysql"].get("pool", {})
+				# autocommit: un SELECT no deja la conexión en transacción, así Release no tiene que mandar un ROLLBACK tras cada préstamo
+				MySQL.Pool = ConnectionPool(
+					{"database": Config["mysql"]["database"], "host": Config["mysql"]["host"], "user": Config["mysql"]["user"], "password": Config["mysql"]["password"], "autocommit": True},
+					Size = PoolCFG.get("size", 10), Timeout = PoolCFG.get("timeout", 10), Recycle = PoolCFG.get("recycle", 1800), PingAfter = PoolCFG.get("ping_after", 30)
+				)
+		return MySQL.Pool
 
 	def GetValueFor(Table : str, Get : str, Row : str, Value):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(f"SELECT {Get} FROM {Table} WHERE {Row} = %s", (Value,))
-		SQLResult = SQLCursor.fetchone()[0]
-		SQLConnection.close()
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLCursor.execute(f"SELECT {Get} FROM {Table} WHERE {Row} = %s", (Value,))
+			SQLResult = SQLCursor.fetchone()[0]
+			SQLCursor.fetchall()
 		return SQLResult
 
+	def IsDuplicate(Error : Exception) -> bool:
+		# ER_DUP_ENTRY
+		return isinstance(Error, mysql.connector.errors.IntegrityError) and Error.errno == mysql.connector.errorcode.ER_DUP_ENTRY
+
 	def LogError(Endpoint : str, UserID, UserIP : str, LogDate : int, Error, Type : str):
 		with contextlib.suppress(Exception): # esto evita que haga un raise a cualquier tipo de error, porque literalmente no queremos un error al logear un error, duh.
-			SQLConnection = MySQL.Connect()
+			with MySQL.Borrow() as SQLConnection:
+				SQLCursor = SQLConnection.cursor()
+				SQLCursor.execute(f"INSERT INTO AD_LOGS (userID, userIP, logDate, description, type) VALUES (%s, %s, %s, %s, %s)", (UserID, UserIP, LogDate, f"{Endpoint}: {Error}", Type))
+				SQLConnection.commit()
+
+	def PoolMetrics() -> list:
+		# vacío hasta que se crea el pool, así un scrape no lo abre
+		if MySQL.Pool is None: return []
+		Stats = MySQL.Pool.Stats()
+		return [
+			("db_pool_connections", "gauge", "Conexiones del pool de MySQL por estado.", [({"state": State}, Stats[State]) for State in ("open", "in_use", "idle")]),
+			("db_pool_size", "gauge", "Conexiones como máximo del pool de MySQL.", [({}, Stats["size"])]),
+			*[(f"db_pool_{Counter}_total", "counter", Help, [({}, Stats[Counter])]) for Counter, Help in [
+				("waits", "Veces que se ha tenido que esperar por una conexión libre."),
+				("timeouts", "Esperas que han acabado en PoolTimeout."),
+				("recycled", "Conexiones cerradas por superar recycle segundos de vida."),
+				("broken", "Conexiones descartadas por estar rotas."),
+				("unread", "Conexiones descartadas por devolverse con filas sin leer (Stream abandonado).")
+			]]
+		]
+
+	def PoolStats() -> dict: return MySQL.GetPool().Stats()
+
+	def Register(UserIP: str, Email: str, Password: str, TownID: int, Dates: str, Role: str = "user") -> int:
+		with MySQL.Borrow() as SQLConnection:
 			SQLCursor = SQLConnection.cursor()
-			SQLCursor.execute(f"INSERT INTO AD_USERS (userID, userIP, logDate, description, type) VALUES (%s, %s, %s, %s, %s)", (UserID, UserIP, LogDate, Error, Type))
+			SQLCursor.execute(
+				"INSERT INTO AD_USERS (userIP, email, password, townID, dates, role) VALUES (%s, %s, %s, %s, %s, %s)",
+				(UserIP, Email, Password, TownID, Dates, Role)
+			)
 			SQLConnection.commit()
-			SQLConnection.close()
-
-	def Register(UserID: int, UserIP: str, Email: str, Password: str, TownID: int, Dates: str, Role: str = "user"):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(
-			"INSERT INTO AD_USERS (userID, userIP, email, password, townID, dates, role) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-			(UserID, UserIP, Email, Password, TownID, Dates, Role)
-		)
-		SQLConnection.commit()
-		SQLConnection.close()
+			return SQLCursor.lastrowid
 
 	def ValueExists(Table : str, Row : str, Value) -> int:
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(f"SELECT {Row} FROM {Table} WHERE {Row} = %s", (Value,))
-		SQLResult = SQLCursor.fetchone()
-		SQLConnection.close()
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLCursor.execute(f"SELECT {Row} FROM {Table} WHERE {Row} = %s", (Value,))
+			SQLResult = SQLCursor.fetchone()
+			SQLCursor.fetchall()
 		return False if SQLResult == None else True
 
-	def AddTown(TownID: int, TownName: str, TownDesc: str, TownImage: str, TownMap: str, TownProvince: str, TownVisibility: bool):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(
-			"INSERT INTO AD_TOWNS (townId, townName, townDescription, townImage, townMap, townProvince, townVisibility) VALUES (%s, %s, %s, %s, %s, %s, %s)", 
-			(TownID, TownName, TownDesc, TownImage, TownMap, TownProvince, TownVisibility)
-		)
-		SQLConnection.commit()
-		SQLConnection.close()
+	def AddTown(TownName: str, TownDesc: str, TownImage: str, TownMap: str, TownProvince: str, TownVisibility: bool) -> int:
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLCursor.execute(
+				"INSERT INTO AD_TOWNS (townName, townDescription, townImage, townMap, townProvince, townVisibility) VALUES (%s, %s, %s, %s, %s, %s)", 
+				(TownName, TownDesc, TownImage, TownMap, TownProvince, TownVisibility)
+			)
+			SQLConnection.commit()
+			return SQLCursor.lastrowid
+
+	def Stream(Query, Params = None, ChunkSize : int = 500):
+		# cursor sin buffer por bloques de ChunkSize filas; si se abandona, Release descarta la conexión
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor(buffered = False)
+			SQLCursor.execute(Query, Params)
+			while True:
+				SQLResults = SQLCursor.fetchmany(ChunkSize)
+				if not SQLResults: break
+				yield SQLResults
 
 	def UpdateItem(Table: str, Columns: list, Values: list, Condition: str, ConditionValues: tuple):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
 
-		ColumnsSTR = ", ".join([f"{col} = %s" for col in Columns])
+			ColumnsSTR = ", ".join([f"{col} = %s" for col in Columns])
 
-		query = f"UPDATE {Table} SET {ColumnsSTR} WHERE {Condition} = %s"
-		parameters = Values + list(ConditionValues)
+			query = f"UPDATE {Table} SET {ColumnsSTR} WHERE {Condition} = %s"
+			parameters = Values + list(ConditionValues)
 
-		try:
-			SQLCursor.execute(query, parameters)
+			try:
+				SQLCursor.execute(query, parameters)
+				SQLConnection.commit()
+			except mysql.connector.Error as err:
+				print(f"Error: {err}")
+			finally:
+				SQLCursor.close()
+
+	def Delete(Table: str, Row: str, Value):
+		with MySQL.Borrow() as SQLConnection:
+			SQLCursor = SQLConnection.cursor()
+			SQLCursor.execute(f"DELETE FROM {Table} WHERE {Row} = %s", (Value,))
 			SQLConnection.commit()
-		except mysql.connector.Error as err:
-			print(f"Error: {err}")
+
+class AsyncMySQL(): # un hilo por conexión del pool, así nunca hay más consultas en vuelo que conexiones
+
+	Executor : concurrent.futures.ThreadPoolExecutor = None
+
+	async def AddItem(Table : str, Columns : list, Values) -> int: return await AsyncMySQL.Run(MySQL.AddItem, Table, Columns, Values)
+
+	async def AddItems(Table : str, Columns : list, Rows : list, ReturnIDs : bool = True, Expressions : dict = None) -> list: return await AsyncMySQL.Run(MySQL.AddItems, Table, Columns, Rows, ReturnIDs, Expressions)
+
+	async def AddTown(TownName: str, TownDesc: str, TownImage: str, TownMap: str, TownProvince: str, TownVisibility: bool) -> int:
+		return await AsyncMySQL.Run(MySQL.AddTown, TownName, TownDesc, TownImage, TownMap, TownProvince, TownVisibility)
+
+	async def Delete(Table: str, Row: str, Value): return await AsyncMySQL.Run(MySQL.Delete, Table, Row, Value)
+
+	async def FetchAll(Query, Params = None): return await AsyncMySQL.Run(MySQL.FetchAll, Query, Params)
+
+	async def FetchBatch(Queries : list) -> list: return await AsyncMySQL.Run(MySQL.FetchBatch, Queries)
+
+	async def FetchOne(Query, Params = None): return await AsyncMySQL.Run(MySQL.FetchOne, Query, Params)
+
+	def GetExecutor() -> concurrent.futures.ThreadPoolExecutor:
+		if AsyncMySQL.Executor is not None: return AsyncMySQL.Executor
+		Pool = MySQL.GetPool()
+		with PoolLock:
+			if AsyncMySQL.Executor is None:
+				AsyncMySQL.Executor = concurrent.futures.ThreadPoolExecutor(max_workers = Pool.Size, thread_name_prefix = "mysql")
+		return AsyncMySQL.Executor
+
+	async def GetValueFor(Table : str, Get : str, Row : str, Value): return await AsyncMySQL.Run(MySQL.GetValueFor, Table, Get, Row, Value)
+
+	async def Register(UserIP: str, Email: str, Password: str, TownID: int, Dates: str, Role: str = "user") -> int:
+		return await AsyncMySQL.Run(MySQL.Register, UserIP, Email, Password, TownID, Dates, Role)
+
+	async def Run(Function, *Args, **KWArgs):
+		return await asyncio.get_running_loop().run_in_executor(AsyncMySQL.GetExecutor(), functools.partial(Function, *Args, **KWArgs))
+
+	async def Stream(Query, Params = None, ChunkSize : int = 500):
+		# cada bloque se lee en el executor
+		Chunks = MySQL.Stream(Query, Params, ChunkSize)
+		try:
+			while True:
+				SQLResults = await AsyncMySQL.Run(next, Chunks, None)
+				if SQLResults is None: break
+				yield SQLResults
 		finally:
-			SQLCursor.close()
-			SQLConnection.close()
+			await AsyncMySQL.Run(Chunks.close)
 
-	def Delete(Table: str, Row: str, Value):
-		SQLConnection = MySQL.Connect()
-		SQLCursor = SQLConnection.cursor()
-		SQLCursor.execute(f"DELETE FROM {Table} WHERE {Row} = %s", (Value,))
-		SQLConnection.commit()
-		SQLConnection.close()
+	def Shutdown():
+		if AsyncMySQL.Executor is not None: AsyncMySQL.Executor.shutdown(wait = True)
+		AsyncMySQL.Executor = None
+		if MySQL.Pool is not None: MySQL.Pool.Shutdown()
+
+	async def UpdateItem(Table: str, Columns: list, Values: list, Condition: str, ConditionValues: tuple):
+		return await AsyncMySQL.Run(MySQL.UpdateItem, Table, Columns, Values, Condition, ConditionValues)
+
+	async def ValueExists(Table : str, Row : str, Value) -> int: return await AsyncMySQL.Run(MySQL.ValueExists, Table, Row, Value)
+
+Metrics.Register(MySQL.PoolMetrics)
@@ -1,29 +1,74 @@
 # -*- coding: utf-8 -*-
 
-import datetime, fastapi, time
-from utils.files import JSON
-from utils.security import IP
+import base64, binascii, datetime, fastapi, hashlib, json, time
+from utils.files import JSON, Registry
+from utils.security import AccessRules, IP
 
-def APILoader(Route : str, Request : fastapi.Request):
+class APIMiddleware(): # APILoader antes de llegar a un endpoint o a MySQL
+
+	def __init__(self, App): self.App = App
+
+	async def __call__(self, Scope, Receive, Send):
+		if Scope["type"] != "http": return await self.App(Scope, Receive, Send)
+		APIData = APILoader(Scope["path"], fastapi.Request(Scope))
+		if APIData != True: return await APIData(Scope, Receive, Send)
+		await self.App(Scope, Receive, Send)
+
+class Encoded(): # se serializa una vez al guardarlo en caché y cada respuesta solo copia los bytes
+
+	__slots__ = ("Data", "Body", "ETag")
+
+	def __init__(self, Data):
+		self.Data, self.Body = Data, JSON.Encode(Data)
+		self.ETag = ETag(self.Body)
+
+	def Array(Items) -> bytes: return b"[" + b",".join(Item.Body for Item in Items) + b"]"
+
+class FastJSON(fastapi.responses.Response): # bytes ya codificados, sin pasar por response_model
 
-	RoutesCFG : dict = JSON.Read("database/routes.json")
-	UserIP = IP.Extract(Request)
+	media_type = "application/json"
 
-	if UserIP in RoutesCFG["blacklist"]["*"]: 
-		return fastapi.responses.JSONResponse(status_code = 401, content = {"status": 401, "message": GetMSG("api.blacklisted")})
+	def render(self, Content) -> bytes: return Content if isinstance(Content, bytes) else JSON.Encode(Content)
+
+class Cursor(): # cursores opacos (base64 de la última clave) para paginar por keyset
+
+	PageSize = 100
+	MaxPageSize = 1000
+
+	def Decode(Token : str, Type = int):
+		# 400 si no es JSON válido o no es de tipo Type
+		try: Key = json.loads(base64.urlsafe_b64decode(Token + "=" * (-len(Token) % 4)))["k"]
+		except (binascii.Error, ValueError, KeyError, TypeError): Key = None
+		if not isinstance(Key, Type) or isinstance(Key, bool): raise fastapi.HTTPException(status_code = 400, detail = GetMSG("api.bad_cursor"))
+		return Key
+
+	def Encode(Key) -> str: return base64.urlsafe_b64encode(JSON.Stringify({"k": Key}).encode("utf-8")).decode("ascii").rstrip("=")
+
+	def Page(Rows : list, Limit : int, KeyIndex : int = 0):
+		# recibe Limit + 1 filas y devuelve (página, cursor de la siguiente o None)
+		if Limit is None or len(Rows) <= Limit: return Rows, None
+		return Rows[:Limit], Cursor.Encode(Rows[Limit - 1][KeyIndex])
+
+	def Link(Request : fastapi.Request, Response : fastapi.Response, Next : str):
+		if Next is None: return
+		Response.headers["X-Next-Cursor"] = Next
+		Response.headers["Link"] = f'<{Request.url.include_query_params(cursor = Next)}>; rel="next"'
+
+def APILoader(Route : str, Request : fastapi.Request):
 
-	if Route in RoutesCFG["blacklist"] and UserIP in RoutesCFG["blacklist"][Route]: 
-		return fastapi.responses.JSONResponse(status_code = 401, content = {"status": 401, "message": GetMSG("api.blacklisted")})
+	Rejected = AccessRules.Current().Check(Route, str(Request.url), IP.Extract(Request))
+	if Rejected is None: return True
 
-	if not any(str(Request.url).startswith(EndPoint) for EndPoint in RoutesCFG["endpoints"]): 
-		return fastapi.responses.JSONResponse(status_code = 403, content = {"status": 403, "message": GetMSG("api.bad_domain")})
+	Status, Message = Rejected
+	return fastapi.responses.JSONResponse(status_code = Status, content = {"status": Status, "message": GetMSG(Message)})
 
-	if not Route in RoutesCFG["whitelist"]: return True 
-	
-	if UserIP in RoutesCFG["whitelist"]["*"] or UserIP in RoutesCFG["whitelist"][Route]: return True 
+def SQLWhere(Conditions : dict):
+	# {"townProvince = %s": "Málaga", "townVisibility = %s": None} -> (" WHERE townProvince = %s", ["Málaga"])
+	Clauses = [Clause for Clause, Value in Conditions.items() if Value is not None]
+	return (f" WHERE {' AND '.join(Clauses)}" if Clauses else ""), [Value for Value in Conditions.values() if Value is not None]
 
-	return fastapi.responses.JSONResponse(status_code = 403, content = {"status": 403, "message": GetMSG("api.not_whitelisted")}) 
+def ETag(Body : bytes) -> str: return f'"{hashlib.blake2b(Body, digest_size = 16).hexdigest()}"'
 
-def GetMSG(Key : str) -> str: return JSON.Read("database/messages.json")[Key]
+def GetMSG(Key : str) -> str: return Registry.Get("database/messages.json")[Key]
 
-def Now(Mode = None): return int(time.time()) if Mode == None else datetime.datetime.now().strftime(Mode)
\ No newline at end of file
+def Now(Mode = None): return int(time.time()) if Mode == None else datetime.datetime.now().strftime(Mode)
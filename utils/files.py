@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
 
-import json, os, shutil
+import json, os, shutil, threading, time, types
+
+try: import orjson # opcional: sin él JSON.Encode usa json de la librería estándar
+except ImportError: orjson = None
 
 class JSON():
 	def ASCII(Data, Ensure : bool = True): return json.dumps(Data, ensure_ascii = Ensure)
+	def Encode(Data) -> bytes:
+		# con orjson si está instalado
+		if orjson is not None: return orjson.dumps(Data)
+		return json.dumps(Data, ensure_ascii = False, separators = (",", ":")).encode("utf-8")
+	def Freeze(Data):
+		if isinstance(Data, dict): return types.MappingProxyType({Key: JSON.Freeze(Value) for Key, Value in Data.items()})
+		if isinstance(Data, list): return tuple(JSON.Freeze(Value) for Value in Data)
+		return Data
 	def Indent(Data, Indent = "\t"): return json.dumps(Data, indent = Indent)
 	def Read(Path : str, Encoding : str = "utf-8"):
 		with open(Path, "r", encoding = Encoding) as File: return json.load(File)
@@ -11,4 +22,31 @@ class JSON():
 	def Write(Path: str, Data, Encoding : str = "utf-8"):
 		with open(Path, "w", encoding = Encoding) as File: json.dump(Data, File, indent = "\t")
 
-def PurgeCache(Caches : list): [shutil.rmtree(Cache) for Cache in Caches if os.path.exists(Cache)]
\ No newline at end of file
+class Registry(): # snapshots inmutables de los JSON; se vuelven a leer si cambia su mtime (se mira cada `CheckInterval` segundos)
+
+	CheckInterval : float = 1.0
+	Entries : dict = {}
+	Lock = threading.Lock()
+
+	def Get(Path : str):
+		Entry = Registry.Entries.get(Path)
+		if Entry is not None and time.monotonic() - Entry["checked"] < Registry.CheckInterval: return Entry["data"]
+		with Registry.Lock:
+			Entry = Registry.Entries.get(Path)
+			MTime = os.stat(Path).st_mtime_ns
+			if Entry is None or Entry["mtime"] != MTime:
+				Entry = {"data": JSON.Freeze(JSON.Read(Path)), "mtime": MTime, "version": Entry["version"] + 1 if Entry else 1}
+			Entry["checked"] = time.monotonic()
+			Registry.Entries[Path] = Entry
+		return Entry["data"]
+
+	def Reload(Path : str = None):
+		with Registry.Lock:
+			for Key in ([Path] if Path else list(Registry.Entries)):
+				if Key in Registry.Entries: Registry.Entries[Key].update(mtime = None, checked = float("-inf"))
+
+	def Version(Path : str) -> int:
+		Registry.Get(Path)
+		return Registry.Entries[Path]["version"]
+
+def PurgeCache(Caches : list): [shutil.rmtree(Cache) for Cache in Caches if os.path.exists(Cache)]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, fastapi, hashlib, httpx, time
+from utils.cache import CatalogCache, Reloader
+from utils.changes import ChangeFeed
+from utils.easify import FastJSON
+from utils.files import Registry
+
+class HTTPCache(): # ETag = versión del catálogo + URL, así un If-None-Match se contesta sin leer el catálogo
+
+	Checked : float = None
+	Client : httpx.AsyncClient = None
+	Current : int = None
+	Hooks : list = []
+	Lock : asyncio.Lock = None
+	Tasks : set = set()
+
+	def Settings() -> dict:
+		Defaults = {"max_age": 60, "s_maxage": 600, "stale_while_revalidate": 60, "version_ttl": 1, "purge": {}}
+		return {**Defaults, **Registry.Get("config.json").get("http_cache", {})}
+
+	def Fresh() -> bool: return HTTPCache.Checked is not None and time.monotonic() - HTTPCache.Checked < HTTPCache.Settings()["version_ttl"]
+
+	async def Version() -> int:
+		# None si no se puede leer; si ha cambiado se vacían la caché y los índices de este worker
+		if HTTPCache.Fresh(): return HTTPCache.Current
+		if HTTPCache.Lock is None: HTTPCache.Lock = asyncio.Lock()
+		async with HTTPCache.Lock:
+			if HTTPCache.Fresh(): return HTTPCache.Current
+			try: Version = await ChangeFeed.Latest()
+			except Exception as Error:
+				print(f"Catalog version could not be read ({type(Error).__name__}: {Error})")
+				return None
+			if Version != HTTPCache.Current:
+				CatalogCache.Clear()
+				for Index in Reloader.Instances: Index.Expire()
+			HTTPCache.Current, HTTPCache.Checked = Version, time.monotonic()
+			return Version
+
+	def VersionTag(Request : fastapi.Request, Version : int, Vary : tuple = ()) -> str:
+		Key = "\n".join([Request.url.path, Request.url.query, *map(str, Vary)]).encode("utf-8")
+		return f'"v{Version}-{hashlib.blake2b(Key, digest_size = 12).hexdigest()}"'
+
+	def Changed(Keys : list):
+		# la purga va en segundo plano y la próxima petición vuelve a leer la versión
+		HTTPCache.Checked = None
+		try: Loop = asyncio.get_running_loop()
+		except RuntimeError: return
+		Task = Loop.create_task(HTTPCache.Purge(list(Keys)))
+		HTTPCache.Tasks.add(Task)
+		Task.add_done_callback(HTTPCache.Tasks.discard)
+
+	def Register(Hook):
+		# Hook(claves) puede ser una función o una corrutina
+		HTTPCache.Hooks.append(Hook)
+
+	async def Purge(Keys : list):
+		for Hook in [HTTPCache.PurgeURL, *HTTPCache.Hooks]:
+			try:
+				Result = Hook(Keys)
+				if asyncio.iscoroutine(Result): await Result
+			except Exception as Error: print(f"Cache purge hook failed ({type(Error).__name__}: {Error})")
+
+	async def PurgeURL(Keys : list):
+		# formato de Cloudflare: POST {"tags": [...]} con token Bearer
+		Purge = HTTPCache.Settings()["purge"]
+		if not Purge.get("url"): return
+		if HTTPCache.Client is None: HTTPCache.Client = httpx.AsyncClient(timeout = httpx.Timeout(5.0))
+		Response = await HTTPCache.Client.post(Purge["url"], json = {"tags": Keys}, headers = {"Authorization": f"Bearer {Purge.get('token', '')}"})
+		Response.raise_for_status()
+
+	def Matches(IfNoneMatch : str, ETag : str) -> bool:
+		if IfNoneMatch.strip() == "*": return True
+		return any(Candidate.strip().removeprefix("W/") == ETag for Candidate in IfNoneMatch.split(","))
+
+	def NotModified(Request : fastapi.Request, ETag : str) -> bool:
+		IfNoneMatch = Request.headers.get("if-none-match")
+		return bool(IfNoneMatch) and HTTPCache.Matches(IfNoneMatch, ETag)
+
+	def Respond(Request : fastapi.Request, Body : bytes, ETag : str, Keys : list, Public : bool = True) -> fastapi.Response:
+		# JSON con ETag, Cache-Control y Surrogate-Key, o 304 si el cliente ya tiene esa versión
+		Settings = HTTPCache.Settings()
+		Headers = {
+			"ETag": ETag,
+			"Cache-Control": f"public, max-age={Settings['max_age']}, s-maxage={Settings['s_maxage']}, stale-while-revalidate={Settings['stale_while_revalidate']}" if Public else "no-store",
+			"Surrogate-Key": " ".join(Keys),
+			"Cache-Tag": ",".join(Keys)
+		}
+		if HTTPCache.NotModified(Request, ETag): return fastapi.Response(status_code = 304, headers = Headers)
+		return FastJSON(Body, headers = Headers)
+
+	async def Close():
+		if HTTPCache.Tasks: await asyncio.gather(*HTTPCache.Tasks, return_exceptions = True)
+		if HTTPCache.Client is not None: await HTTPCache.Client.aclose()
+		HTTPCache.Client = None
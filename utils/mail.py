@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import asyncio, collections, concurrent.futures, smtplib, time, uuid
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from utils.cache import LRUCache
+from utils.files import Registry
+
+class Mailer(): # los endpoints encolan y un worker envía por lotes con una sesión SMTP persistente y reintentos
+
+	Counters = collections.Counter()
+	Executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "smtp") # la sesión SMTP solo se usa desde este hilo
+	LastUsed : float = 0.0
+	Queue : asyncio.Queue = None
+	Session : smtplib.SMTP = None
+	Statuses = LRUCache(Size = 10000, TTL = 86400)
+	Worker : asyncio.Task = None
+
+	def Settings() -> dict:
+		Config = Registry.Get("config.json")
+		Defaults = {"host": "smtp.sendgrid.net", "port": 587, "username": "apikey", "password": Config["keys"]["SENDGRID_API_KEY"], "starttls": True,
+					"timeout": 10, "batch_size": 20, "max_retries": 5, "backoff": 2.0, "queue_size": 1000, "idle_timeout": 60}
+		return {**Defaults, **Config.get("smtp", {})}
+
+	def Connect(Settings : dict) -> smtplib.SMTP:
+		Session = smtplib.SMTP(Settings["host"], Settings["port"], timeout = Settings["timeout"])
+		try:
+			if Settings["starttls"]: Session.starttls()
+			if Settings["username"]: Session.login(Settings["username"], Settings["password"])
+		except BaseException:
+			Session.close()
+			raise
+		Mailer.Counters["connections"] += 1
+		return Session
+
+	def Disconnect():
+		if Mailer.Session is None: return
+		try: Mailer.Session.quit()
+		except Exception: pass
+		Mailer.Session = None
+
+	def Permanent(Error : Exception) -> bool:
+		# un 5xx es permanente: reintentarlo daría lo mismo
+		if isinstance(Error, smtplib.SMTPRecipientsRefused): return all(Code >= 500 for Code, _ in Error.recipients.values())
+		return isinstance(Error, smtplib.SMTPResponseException) and Error.smtp_code >= 500
+
+	def SendBatch(Messages : list) -> list:
+		# en el hilo SMTP; devuelve por mensaje None o (error, permanente) y solo reconecta si se ha caído la conexión
+		Settings = Mailer.Settings()
+		if Mailer.Session is not None and time.monotonic() - Mailer.LastUsed > Settings["idle_timeout"]:
+			try: Mailer.Session.noop()
+			except OSError: Mailer.Disconnect() # smtplib.SMTPException es subclase de OSError
+		Errors, Fatal = [], None
+		for Message in Messages:
+			if Fatal is not None:
+				Errors.append(Fatal)
+				continue
+			for Attempt in range(2): # si el servidor ha cerrado la conexión se reconecta una vez
+				try:
+					if Mailer.Session is None: Mailer.Session = Mailer.Connect(Settings)
+					Mailer.Session.sendmail(Message["from"], Message["to"], Message["data"])
+					Errors.append(None)
+					break
+				except smtplib.SMTPServerDisconnected as Error: Failure = Error
+				except smtplib.SMTPException as Error:
+					Errors.append((str(Error), Mailer.Permanent(Error)))
+					if Mailer.Session is None: Fatal = Errors[-1] # ha fallado el login: el resto del lote fallaría igual
+					break
+				except OSError as Error: Failure = Error # ConnectionError, TimeoutError, TLS...: la conexión ya no sirve
+				Mailer.Disconnect()
+				if Attempt == 1: Errors.append((str(Failure), False))
+		Mailer.LastUsed = time.monotonic()
+		return Errors
+
+	def Enqueue(FromEmail : str, ToEmail : str, Subject : str, Body : str) -> str:
+		# asyncio.QueueFull si la cola está llena
+		if Mailer.Worker is None: Mailer.Start()
+		Message = MIMEMultipart()
+		Message["From"] = FromEmail
+		Message["To"] = ToEmail
+		Message["Subject"] = Subject
+		Message.attach(MIMEText(Body, "html"))
+		ID = uuid.uuid4().hex
+		Mailer.Queue.put_nowait({"id": ID, "from": FromEmail, "to": ToEmail, "data": Message.as_string(), "attempts": 0})
+		Mailer.SetStatus(ID, "queued")
+		Mailer.Counters["queued"] += 1
+		return ID
+
+	def Requeue(Message : dict):
+		try: Mailer.Queue.put_nowait(Message)
+		except (asyncio.QueueFull, AttributeError): Mailer.SetStatus(Message["id"], "failed", Message["attempts"], "queue full")
+
+	async def Run():
+		Loop = asyncio.get_running_loop()
+		while True:
+			Messages = [await Mailer.Queue.get()]
+			Settings = Mailer.Settings()
+			while len(Messages) < Settings["batch_size"] and not Mailer.Queue.empty(): Messages.append(Mailer.Queue.get_nowait())
+			for Message in Messages: Mailer.SetStatus(Message["id"], "sending", Message["attempts"])
+			try: Errors = await Loop.run_in_executor(Mailer.Executor, Mailer.SendBatch, Messages)
+			except Exception as Error: Errors = [(str(Error), False)] * len(Messages)
+			for Message, Result in zip(Messages, Errors):
+				Message["attempts"] += 1
+				if Result is None:
+					Mailer.SetStatus(Message["id"], "sent", Message["attempts"])
+					Mailer.Counters["sent"] += 1
+					continue
+				Error, Permanent = Result
+				if not Permanent and Message["attempts"] < Settings["max_retries"]:
+					Mailer.SetStatus(Message["id"], "retrying", Message["attempts"], Error)
+					Mailer.Counters["retries"] += 1
+					Loop.call_later(Settings["backoff"] ** Message["attempts"], Mailer.Requeue, Message)
+				else:
+					Mailer.SetStatus(Message["id"], "failed", Message["attempts"], Error)
+					Mailer.Counters["failed"] += 1
+
+	def SetStatus(ID : str, Status : str, Attempts : int = 0, Error : str = None):
+		Mailer.Statuses.Set(ID, {"id": ID, "status": Status, "attempts": Attempts, "error": Error, "updated": int(time.time())})
+
+	def Start():
+		if Mailer.Worker is not None: return
+		Mailer.Queue = asyncio.Queue(maxsize = Mailer.Settings()["queue_size"])
+		Mailer.Worker = asyncio.get_running_loop().create_task(Mailer.Run())
+
+	def Stats() -> dict:
+		return {"pending": Mailer.Queue.qsize() if Mailer.Queue else 0, "connected": Mailer.Session is not None, **{Key: Mailer.Counters[Key] for Key in ["queued", "sent", "retries", "failed", "connections"]}}
+
+	def Status(ID : str) -> dict: return Mailer.Statuses.Get(ID)
+
+	async def Stop():
+		# lo que quede en la cola se intenta enviar una vez
+		if Mailer.Worker is None: return
+		Mailer.Worker.cancel()
+		try: await Mailer.Worker
+		except asyncio.CancelledError: pass
+		Messages = []
+		while not Mailer.Queue.empty(): Messages.append(Mailer.Queue.get_nowait())
+		Loop = asyncio.get_running_loop()
+		if Messages:
+			Errors = await Loop.run_in_executor(Mailer.Executor, Mailer.SendBatch, Messages)
+			for Message, Result in zip(Messages, Errors): Mailer.SetStatus(Message["id"], "sent" if Result is None else "failed", Message["attempts"] + 1, None if Result is None else Result[0])
+		await Loop.run_in_executor(Mailer.Executor, Mailer.Disconnect)
+		Mailer.Worker = Mailer.Queue = None
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import bisect, functools, hmac, ipaddress, re, threading, time
+from utils.files import Registry
+from utils.security import IPSet
+
+class Histogram(): # cubos fijos al estilo Prometheus, el último es +Inf
+
+	__slots__ = ("Buckets", "Counts", "Sum", "Count")
+
+	def __init__(self, Buckets : tuple):
+		self.Buckets = Buckets
+		self.Counts = [0] * (len(Buckets) + 1)
+		self.Sum = 0.0
+		self.Count = 0
+
+	def Observe(self, Value : float):
+		self.Counts[bisect.bisect_left(self.Buckets, Value)] += 1
+		self.Sum += Value
+		self.Count += 1
+
+class Metrics(): # cada worker lleva sus propias cuentas
+
+	Acquires : dict = {}
+	Allow = None
+	Collectors : list = []
+	Errors : dict = {}
+	Lock = threading.Lock()
+	Queries : dict = {}
+	Requests : dict = {}
+	Rows : dict = {}
+
+	Buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+	RowBuckets = (0, 1, 10, 100, 1000, 10000, 100000)
+
+	Literals = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|\b\d+(?:\.\d+)?\b|%s|%\(\w+\)s")
+	Lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+	Spaces = re.compile(r"\s+")
+
+	def Settings() -> dict: return {"enabled": True, "slow_query_ms": 500, "max_statements": 500, "allow": ["127.0.0.1", "::1"], "token": None, **Registry.Get("config.json").get("metrics", {})}
+
+	def Enabled() -> bool: return Metrics.Settings()["enabled"]
+
+	def Allowed(Request) -> bool:
+		# se mira la IP de la conexión y no IP.Extract: routes.json y las cabeceras de proxy no sirven para proteger /metrics
+		Settings, Version = Metrics.Settings(), Registry.Version("config.json")
+		Allow = Metrics.Allow
+		if Allow is None or Allow[0] != Version: Allow = Metrics.Allow = (Version, IPSet(Settings["allow"]))
+		Peer = Request.client.host if Request.client and Request.client.host else ""
+		try: Address = ipaddress.ip_address(Peer)
+		except ValueError: Address = None
+		if not Allow[1].Contains(Peer, Address): return False
+		return not Settings["token"] or hmac.compare_digest(Request.headers.get("authorization", "").encode(), f"Bearer {Settings['token']}".encode())
+
+	@functools.lru_cache(maxsize = 2048)
+	def Fingerprint(Query) -> str:
+		# '... IN (%s, %s) LIMIT 20' -> '... IN (...) LIMIT ?'
+		if isinstance(Query, (bytes, bytearray)): Query = Query.decode("utf-8", "replace")
+		Query = Metrics.Lists.sub("(...)", Metrics.Literals.sub("?", Query))
+		return Metrics.Spaces.sub(" ", Query).strip().rstrip(";")[:300]
+
+	def Observe(Series : dict, Key : tuple, Value : float, Buckets : tuple = None):
+		Data = Series.get(Key)
+		if Data is None: Data = Series[Key] = Histogram(Buckets or Metrics.Buckets)
+		Data.Observe(Value)
+
+	def Request(Route : str, Method : str, Status : int, Seconds : float):
+		with Metrics.Lock: Metrics.Observe(Metrics.Requests, (Route, Method, str(Status)), Seconds)
+
+	def Acquired(Seconds : float):
+		with Metrics.Lock: Metrics.Observe(Metrics.Acquires, (), Seconds)
+
+	def Query(Statement : str, Seconds : float, Rows : int, Failed : bool = False):
+		# pasadas `max_statements` huellas distintas, las nuevas cuentan como "other"
+		Settings = Metrics.Settings()
+		with Metrics.Lock:
+			Key = (Statement,) if (Statement,) in Metrics.Queries or len(Metrics.Queries) < Settings["max_statements"] else ("other",)
+			Metrics.Observe(Metrics.Queries, Key, Seconds)
+			Metrics.Observe(Metrics.Rows, Key, Rows, Metrics.RowBuckets)
+			if Failed: Metrics.Errors[Key] = Metrics.Errors.get(Key, 0) + 1
+		if Settings["slow_query_ms"] is not None and Seconds * 1000 >= Settings["slow_query_ms"]:
+			print(f"Slow query ({Seconds * 1000:.1f} ms, {Rows} rows{', failed' if Failed else ''}): {Statement}")
+
+	def Register(Collector):
+		# Collector() -> [(nombre, tipo, ayuda, [({etiqueta: valor}, valor), ...]), ...]
+		Metrics.Collectors.append(Collector)
+
+	def Escape(Value) -> str: return str(Value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+	def Labels(Names : tuple, Values : tuple) -> str: return ",".join(f'{Name}="{Metrics.Escape(Value)}"' for Name, Value in zip(Names, Values))
+
+	def Series(Lines : list, Name : str, Help : str, Histograms : dict, Names : tuple = ()):
+		Lines += [f"# HELP {Name} {Help}", f"# TYPE {Name} histogram"]
+		for Key, Data in Histograms.items():
+			Labels = Metrics.Labels(Names, Key)
+			Cumulative = 0
+			for Bound, Count in zip((*Data.Buckets, "+Inf"), Data.Counts):
+				Cumulative += Count
+				Lines.append(f'{Name}_bucket{{{Labels + "," if Labels else ""}le="{Bound}"}} {Cumulative}')
+			Lines.append(f"{Name}_sum{{{Labels}}} {Data.Sum}" if Labels else f"{Name}_sum {Data.Sum}")
+			Lines.append(f"{Name}_count{{{Labels}}} {Data.Count}" if Labels else f"{Name}_count {Data.Count}")
+
+	def Render() -> str:
+		# text/plain; version=0.0.4
+		Lines = []
+		with Metrics.Lock:
+			Metrics.Series(Lines, "http_request_duration_seconds", "Latencia de las peticiones HTTP por plantilla de ruta, método y status.", Metrics.Requests, ("route", "method", "status"))
+			Metrics.Series(Lines, "db_query_duration_seconds", "Tiempo de cada consulta MySQL (execute y lectura de filas) por huella de la sentencia.", Metrics.Queries, ("statement",))
+			Metrics.Series(Lines, "db_query_rows", "Filas devueltas por cada consulta MySQL por huella de la sentencia.", Metrics.Rows, ("statement",))
+			Metrics.Series(Lines, "db_pool_acquire_duration_seconds", "Espera para conseguir una conexión del pool de MySQL.", Metrics.Acquires)
+			Lines += ["# HELP db_query_errors_total Consultas MySQL que han fallado por huella de la sentencia.", "# TYPE db_query_errors_total counter"]
+			Lines += [f'db_query_errors_total{{{Metrics.Labels(("statement",), Key)}}} {Count}' for Key, Count in Metrics.Errors.items()]
+		for Collector in Metrics.Collectors:
+			try: Families = Collector()
+			except Exception as Error:
+				print(f"Metrics collector failed ({type(Error).__name__}: {Error})")
+				continue
+			for Name, Type, Help, Samples in Families:
+				Lines += [f"# HELP {Name} {Help}", f"# TYPE {Name} {Type}"]
+				for Labels, Value in Samples:
+					Labels = Metrics.Labels(tuple(Labels), tuple(Labels.values()))
+					Lines.append(f"{Name}{{{Labels}}} {Value}" if Labels else f"{Name} {Value}")
+		return "\n".join(Lines) + "\n"
+
+class MetricsMiddleware(): # anota cada petición con la plantilla de la ruta, no con la URL
+
+	def __init__(self, App): self.App = App
+
+	async def __call__(self, Scope, Receive, Send):
+		if Scope["type"] != "http" or not Metrics.Enabled(): return await self.App(Scope, Receive, Send)
+		Start = time.perf_counter()
+		Status = 500 # si el endpoint lanza una excepción la respuesta la manda ServerErrorMiddleware, por fuera de este middleware
+
+		async def Capture(Message):
+			nonlocal Status
+			if Message["type"] == "http.response.start": Status = Message["status"]
+			await Send(Message)
+
+		try: await self.App(Scope, Receive, Capture)
+		finally: Metrics.Request(MetricsMiddleware.Template(Scope), Scope["method"], Status, time.perf_counter() - Start)
+
+	def Template(Scope) -> str:
+		# según la versión de FastAPI la ruta puede no llevar el prefijo de include_router
+		Route = Scope.get("route")
+		if Route is None: return "unmatched"
+		Path, Regex = Scope["path"], getattr(Route, "path_regex", None)
+		if Regex is None: return Route.path
+		Index = 0
+		while Index != -1:
+			if Regex.match(Path[Index:]): return Path[:Index] + Route.path
+			Index = Path.find("/", Index + 1)
+		return Route.path
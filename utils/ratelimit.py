@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import fastapi, math, os, sys, threading, time
+from utils.cache import LRUCache
+from utils.easify import GetMSG
+from utils.files import Registry
+from utils.security import IP
+from jwtconfig import decode_access_token
+
+try: import redis.asyncio as redis # opcional: solo hace falta con "backend": "redis://..."
+except ImportError: redis = None
+
+class MemoryBackend(): # con varios workers cada uno lleva su cuenta y el límite se multiplica
+
+	def __init__(self):
+		self.Buckets = LRUCache(Size = 100000)
+		self.Lock = threading.Lock()
+
+	async def Take(self, Key : str, Rate : float, Burst : int):
+		# devuelve (permitida, tokens que quedan, segundos hasta el siguiente token)
+		with self.Lock:
+			Now = time.monotonic()
+			Tokens, Stamp = self.Buckets.Get(Key, (Burst, Now))
+			Tokens = min(Burst, Tokens + (Now - Stamp) * Rate)
+			Allowed = Tokens >= 1
+			if Allowed: Tokens -= 1
+			self.Buckets.Set(Key, (Tokens, Now), TTL = Burst / Rate) # pasado ese tiempo el cubo estaría lleno otra vez
+		return Allowed, int(Tokens), 0 if Allowed else (1 - Tokens) / Rate
+
+	async def Close(self): pass
+
+class RedisBackend(): # un script Lua atómico por comprobación, con la hora del servidor
+
+	Script = """
+	local Now = redis.call("TIME")
+	Now = tonumber(Now[1]) + tonumber(Now[2]) / 1000000
+	local Rate, Burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+	local Bucket = redis.call("HMGET", KEYS[1], "tokens", "stamp")
+	local Tokens, Stamp = tonumber(Bucket[1]) or Burst, tonumber(Bucket[2]) or Now
+	Tokens = math.min(Burst, Tokens + (Now - Stamp) * Rate)
+	local Allowed = 0
+	if Tokens >= 1 then Tokens = Tokens - 1; Allowed = 1 end
+	redis.call("HSET", KEYS[1], "tokens", tostring(Tokens), "stamp", tostring(Now))
+	redis.call("PEXPIRE", KEYS[1], math.ceil(Burst / Rate * 1000))
+	return {Allowed, tostring(Tokens)}
+	"""
+
+	def __init__(self, URL : str):
+		if redis is None: raise RuntimeError("ratelimit.backend apunta a Redis pero el paquete redis no está instalado (pip install redis)")
+		self.Client = redis.from_url(URL)
+		self.TakeScript = self.Client.register_script(RedisBackend.Script)
+
+	async def Take(self, Key : str, Rate : float, Burst : int):
+		Allowed, Tokens = await self.TakeScript(keys = [f"ratelimit:{Key}"], args = [Rate, Burst])
+		Tokens = float(Tokens)
+		return bool(Allowed), int(Tokens), 0 if Allowed else (1 - Tokens) / Rate
+
+	async def Close(self): await self.Client.aclose()
+
+class UnavailableBackend(): # cada Take falla y Check aplica fail_open
+
+	def __init__(self, Error : Exception): self.Error = Error
+
+	async def Take(self, Key : str, Rate : float, Burst : int): raise self.Error
+
+	async def Close(self): pass
+
+class RateLimits(): # se aplica solo la regla más específica; con token se cuenta por email y sin él por IP
+
+	Backend = None
+	Compiled = None
+	Lock = threading.Lock()
+	Periods = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+	def __init__(self, LimitsCFG : dict):
+		self.Enabled = LimitsCFG.get("enabled", True)
+		self.FailOpen = LimitsCFG.get("fail_open", True)
+		self.Routes = {Route: RateLimits.Rule(Rule) for Route, Rule in LimitsCFG.get("routes", {}).items()}
+
+	def Parse(Rate : str):
+		# '10/minute' -> (10, 'minute', tokens por segundo)
+		if Rate is None: return None
+		Count, Period = Rate.split("/")
+		return int(Count), Period, int(Count) / RateLimits.Periods[Period]
+
+	def Rule(RuleCFG : dict) -> dict:
+		return {
+			"burst": RuleCFG.get("burst"),
+			"default": RateLimits.Parse(RuleCFG["rate"]),
+			"methods": frozenset(Method.upper() for Method in RuleCFG["methods"]) if "methods" in RuleCFG else None,
+			"rates": {Role: RateLimits.Parse(Rate) for Role, Rate in RuleCFG.get("roles", {}).items()}
+		}
+
+	def Current() -> "RateLimits":
+		Version = Registry.Version("config.json")
+		Compiled = RateLimits.Compiled
+		if Compiled is not None and Compiled[0] == Version: return Compiled[1]
+		with RateLimits.Lock:
+			if RateLimits.Compiled is None or RateLimits.Compiled[0] != Version:
+				LimitsCFG = Registry.Get("config.json").get("ratelimit", {})
+				RateLimits.Compiled = (Version, RateLimits(LimitsCFG))
+				BackendURL = LimitsCFG.get("backend", "memory")
+				if RateLimits.Backend is None or RateLimits.Backend[0] != BackendURL:
+					if BackendURL == "memory" and RateLimits.Workers() > 1: print(f"Rate limit backend is memory with {RateLimits.Workers()} workers: each worker keeps its own buckets, so every limit is multiplied by {RateLimits.Workers()}; set ratelimit.backend to redis://...")
+					try: Backend = MemoryBackend() if BackendURL == "memory" else RedisBackend(BackendURL)
+					except Exception as Error:
+						print(f"Rate limit backend {BackendURL} could not be created ({type(Error).__name__}: {Error})")
+						Backend = UnavailableBackend(Error)
+					RateLimits.Backend = (BackendURL, Backend)
+			return RateLimits.Compiled[1]
+
+	def Workers() -> int:
+		# uvicorn y gunicorn toman WEB_CONCURRENCY por defecto; los workers de uvicorn --workers N heredan el argv del proceso principal
+		Arguments = sys.argv[1:]
+		for Index, Argument in enumerate(Arguments):
+			Value = Argument.split("=", 1)[1] if Argument.startswith("--workers=") else Arguments[Index + 1] if Argument in ("--workers", "-w") and Index + 1 < len(Arguments) else None
+			if Value is not None and Value.isdigit(): return int(Value)
+		Value = os.environ.get("WEB_CONCURRENCY", "")
+		return int(Value) if Value.isdigit() else 1
+
+	def Match(self, Route : str, Method : str):
+		# (clave, regla) de la más específica o None
+		Parts = Route.rstrip("/").split("/")
+		for Key in [Route, *("/".join(Parts[:Index]) + "/*" for Index in range(len(Parts), 0, -1)), "*"]:
+			Rule = self.Routes.get(Key)
+			if Rule is not None and (Rule["methods"] is None or Method in Rule["methods"]): return Key, Rule
+		return None
+
+	def Identity(Request : fastapi.Request):
+		# un token que no es válido cuenta como anónimo
+		Authorization = Request.headers.get("authorization", "")
+		if Authorization[:7].lower() == "bearer ":
+			Payload = decode_access_token(Authorization[7:].strip())
+			if Payload is not None and Payload.get("email"): return Payload.get("role", "user"), f"user:{Payload['email']}"
+		return "anonymous", f"ip:{IP.Extract(Request)}"
+
+	async def Check(self, Request : fastapi.Request):
+		# None o (límite, periodo, segundos de espera)
+		if not self.Enabled: return None
+		Matched = self.Match(Request.url.path, Request.method)
+		if Matched is None: return None
+		RouteKey, Rule = Matched
+		Role, Client = RateLimits.Identity(Request)
+		Rate = Rule["rates"][Role] if Role in Rule["rates"] else Rule["default"]
+		if Rate is None: return None
+		Count, Period, PerSecond = Rate
+		try: Allowed, _, RetryAfter = await RateLimits.Backend[1].Take(f"{RouteKey}|{Role}|{Client}", PerSecond, Rule["burst"] or Count)
+		except Exception as Error:
+			print(f"Rate limit backend failed ({type(Error).__name__}), fail_open = {self.FailOpen}")
+			return None if self.FailOpen else (Count, Period, 1)
+		return None if Allowed else (Count, Period, RetryAfter)
+
+	async def Close():
+		if RateLimits.Backend is not None: await RateLimits.Backend[1].Close()
+		RateLimits.Backend = RateLimits.Compiled = None
+
+class RateLimitMiddleware(): # antes de llegar al endpoint o a MySQL
+
+	def __init__(self, App): self.App = App
+
+	async def __call__(self, Scope, Receive, Send):
+		if Scope["type"] != "http": return await self.App(Scope, Receive, Send)
+		Limited = await RateLimits.Current().Check(fastapi.Request(Scope))
+		if Limited is None: return await self.App(Scope, Receive, Send)
+		Count, Period, RetryAfter = Limited
+		Response = fastapi.responses.JSONResponse(status_code = 429, content = {"status": 429, "message": GetMSG("error.429").format(Count, Period)}, headers = {"Retry-After": str(max(1, math.ceil(RetryAfter)))})
+		await Response(Scope, Receive, Send)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import bisect, heapq, math, re, unicodedata
+from utils.cache import Reloader
+from utils.database import AsyncMySQL
+
+class InvertedIndex(): # término -> {documento: peso}, más una lista ordenada de términos para los prefijos
+
+	StopWords = frozenset(["a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los", "o", "para", "por", "un", "una", "y"])
+	MaxExpansions = 200 # términos como mucho por prefijo, para que una consulta de una letra no recorra todo el vocabulario
+
+	def __init__(self):
+		self.Postings = {}
+		self.Terms = []
+		self.Documents = {}
+
+	def __len__(self): return len(self.Documents)
+
+	def Fold(Text : str) -> str:
+		# 'Cádiz' -> 'cadiz', 'Peñón' -> 'penon'
+		return "".join(Char for Char in unicodedata.normalize("NFKD", Text.lower()) if not unicodedata.combining(Char))
+
+	def Tokenize(Text : str, StopWords : bool = True) -> list:
+		Terms = re.findall(r"\w+", InvertedIndex.Fold(Text or ""))
+		return [Term for Term in Terms if Term not in InvertedIndex.StopWords] if StopWords else Terms
+
+	def Add(self, Key, Fields : list, Data : dict):
+		# Fields = [(texto, peso), ...]; Data es lo que se devuelve al encontrarlo
+		self.Remove(Key)
+		Weights = {}
+		for Text, Weight in Fields:
+			for Term in InvertedIndex.Tokenize(Text): Weights[Term] = Weights.get(Term, 0) + Weight
+		for Term, Weight in Weights.items():
+			Posting = self.Postings.get(Term)
+			if Posting is None:
+				Posting = self.Postings[Term] = {}
+				bisect.insort(self.Terms, Term)
+			Posting[Key] = Weight
+		self.Documents[Key] = (tuple(Weights), Data)
+
+	def Get(self, Key): return self.Documents[Key][1] if Key in self.Documents else None
+
+	def Remove(self, Key):
+		Document = self.Documents.pop(Key, None)
+		if Document is None: return
+		for Term in Document[0]:
+			Posting = self.Postings[Term]
+			del Posting[Key]
+			if not Posting:
+				del self.Postings[Term]
+				del self.Terms[bisect.bisect_left(self.Terms, Term)]
+
+	def Expand(self, Prefix : str) -> list:
+		Start = bisect.bisect_left(self.Terms, Prefix)
+		End = min(len(self.Terms), Start + InvertedIndex.MaxExpansions)
+		Index = Start
+		while Index < End and self.Terms[Index].startswith(Prefix): Index += 1
+		return self.Terms[Start:Index]
+
+	def Search(self, Query : str, Limit : int = 20, Accept = None) -> list:
+		# todos los términos, completos o como prefijo (a mitad de peso); puntuación = peso del campo x idf
+		Terms = InvertedIndex.Tokenize(Query) or InvertedIndex.Tokenize(Query, StopWords = False)
+		Scores = None
+		for Term in dict.fromkeys(Terms):
+			TermScores = {}
+			for Match in self.Expand(Term):
+				Posting = self.Postings[Match]
+				Boost = (1.0 if Match == Term else 0.5) * math.log(1 + len(self.Documents) / len(Posting))
+				for Key, Weight in Posting.items():
+					if Scores is not None and Key not in Scores: continue
+					TermScores[Key] = max(TermScores.get(Key, 0), Weight * Boost)
+			Scores = TermScores if Scores is None else {Key: Scores[Key] + Score for Key, Score in TermScores.items()}
+			if not Scores: return []
+		Matches = ((Score, self.Documents[Key][1]) for Key, Score in (Scores or {}).items() if Accept is None or Accept(self.Documents[Key][1]))
+		return heapq.nlargest(Limit, Matches, key = lambda Match: (Match[0], -len(Match[1]["name"])))
+
+class CatalogSearch(): # lo que cuelga de un pueblo oculto no sale en los resultados
+
+	Children : dict = {}
+	Hidden : set = set()
+	Index = InvertedIndex()
+	Kinds = ("town", "dish", "monument", "event")
+	Reload = Reloader()
+
+	Queries = [
+		("SELECT townId, townName, townDescription, townProvince, townVisibility FROM AD_TOWNS", None),
+		("SELECT dishId, dishName, dishDescription, townId FROM AD_DISHES", None),
+		("SELECT monumentId, monumentName, monumentDescription, townId FROM AD_MONUMENTS", None),
+		("SELECT eventId, eventName, eventDescription, townId FROM AD_EVENTS", None)
+	]
+
+	def Put(Kind : str, ID : int, TownID : int, Name : str, Description : str = None, Extra : str = None):
+		# Extra es texto con menos peso, por ejemplo la provincia
+		CatalogSearch.Reload.Touch()
+		if CatalogSearch.Reload.Loaded is None: return
+		CatalogSearch.Add(CatalogSearch.Index, CatalogSearch.Children, Kind, ID, TownID, Name, Description, Extra)
+
+	def Add(Index : InvertedIndex, Children : dict, Kind : str, ID : int, TownID : int, Name : str, Description : str = None, Extra : str = None):
+		Index.Add((Kind, ID), [(Name, 4), (Extra, 2), (Description, 1)], {"type": Kind, "id": ID, "townId": TownID, "name": Name})
+		if Kind != "town": Children.setdefault(TownID, set()).add((Kind, ID))
+
+	def Town(TownID : int, Name : str, Description : str = None, Province : str = None, Visible : bool = True):
+		CatalogSearch.Put("town", TownID, TownID, Name, Description, Province)
+		if Visible: CatalogSearch.Hidden.discard(TownID)
+		else: CatalogSearch.Hidden.add(TownID)
+
+	def Remove(Kind : str, ID : int):
+		# al quitar un pueblo se quitan también sus platos, monumentos y eventos
+		CatalogSearch.Reload.Touch()
+		if Kind == "town":
+			for Key in CatalogSearch.Children.pop(ID, ()): CatalogSearch.Index.Remove(Key)
+			CatalogSearch.Hidden.discard(ID)
+		else:
+			Data = CatalogSearch.Index.Get((Kind, ID))
+			if Data is not None: CatalogSearch.Children.get(Data["townId"], set()).discard((Kind, ID))
+		CatalogSearch.Index.Remove((Kind, ID))
+
+	async def Ensure(): await CatalogSearch.Reload.Ensure(CatalogSearch.Load)
+
+	async def Load():
+		Towns, Dishes, Monuments, Events = await AsyncMySQL.FetchBatch(CatalogSearch.Queries)
+		# el índice nuevo se monta aparte y se cambia de golpe, así las búsquedas nunca ven uno a medias
+		Index, Children, Hidden = InvertedIndex(), {}, set()
+		for TownID, Name, Description, Province, Visible in Towns:
+			CatalogSearch.Add(Index, Children, "town", TownID, TownID, Name, Description, Province)
+			if not Visible: Hidden.add(TownID)
+		for Kind, Rows in zip(CatalogSearch.Kinds[1:], [Dishes, Monuments, Events]):
+			for ID, Name, Description, TownID in Rows: CatalogSearch.Add(Index, Children, Kind, ID, TownID, Name, Description)
+		CatalogSearch.Index, CatalogSearch.Children, CatalogSearch.Hidden = Index, Children, Hidden
+
+	async def Search(Query : str, Kinds = None, Limit : int = 20) -> list:
+		await CatalogSearch.Ensure()
+		Hidden, Kinds = CatalogSearch.Hidden, frozenset(Kinds or CatalogSearch.Kinds)
+		Matches = CatalogSearch.Index.Search(Query, Limit, lambda Data: Data["type"] in Kinds and Data["townId"] not in Hidden)
+		return [{**Data, "score": round(Score, 4)} for Score, Data in Matches]
+
+	def Stats() -> dict:
+		return {"documents": len(CatalogSearch.Index), "terms": len(CatalogSearch.Index.Terms), "hidden_towns": len(CatalogSearch.Hidden), "loaded_ago": CatalogSearch.Reload.Age()}
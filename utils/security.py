@@ -1,10 +1,117 @@
 # -*- coding: utf-8 -*-
 
-import fastapi, re, requests
-from utils.files import JSON
+import asyncio, collections.abc, concurrent.futures, fastapi, hashlib, hmac, httpx, ipaddress, os, re, threading, urllib.parse
+from utils.cache import LRUCache
+from utils.files import Registry
 
-class IP():
-	def Extract(request: fastapi.Request) -> str: return "127.0.0.1" if not request.client or not request.client.host else request.headers["CF-Connecting-IP"] if "CF-Connecting-IP" in request.headers else request.client.host
+class IP(): # CF-Connecting-IP / X-Forwarded-For solo cuentan si la conexión viene de un proxy de "proxies.trusted"
+
+	Compiled = None
+
+	def Trusted(UserIP : str) -> bool:
+		Version = Registry.Version("config.json")
+		Compiled = IP.Compiled
+		if Compiled is None or Compiled[0] != Version: Compiled = IP.Compiled = (Version, IPSet(Registry.Get("config.json").get("proxies", {}).get("trusted", [])))
+		try: Address = ipaddress.ip_address(UserIP)
+		except ValueError: Address = None
+		return Compiled[1].Contains(UserIP, Address)
+
+	def Extract(request: fastapi.Request) -> str:
+		if not request.client or not request.client.host: return "127.0.0.1"
+		Peer = request.client.host
+		if not IP.Trusted(Peer): return Peer
+		if "CF-Connecting-IP" in request.headers: return request.headers["CF-Connecting-IP"].strip()
+		# de derecha a izquierda, el primer salto que no es un proxy de confianza es el cliente (lo de su izquierda lo puede inventar él)
+		for Hop in reversed(request.headers.get("X-Forwarded-For", "").split(",")):
+			Hop = Hop.strip()
+			if Hop and not IP.Trusted(Hop): return Hop
+		return Peer
+
+class CIDRTrie(): # un nivel por bit: una IP cuesta como mucho 32/128 pasos sin importar cuántos rangos haya
+
+	def __init__(self): self.Roots = {4: {}, 6: {}}
+
+	def Add(self, Network):
+		Node, Bits, Width = self.Roots[Network.version], int(Network.network_address), Network.max_prefixlen
+		for Index in range(Network.prefixlen): Node = Node.setdefault((Bits >> (Width - 1 - Index)) & 1, {})
+		Node[None] = True
+
+	def Contains(self, Address) -> bool:
+		Node, Bits, Width = self.Roots[Address.version], int(Address), Address.max_prefixlen
+		for Index in range(Width):
+			if None in Node: return True
+			Node = Node.get((Bits >> (Width - 1 - Index)) & 1)
+			if Node is None: return False
+		return None in Node
+
+class IPSet(): # IPs sueltas en un set y rangos CIDR en el CIDRTrie
+
+	def __init__(self, Entries):
+		self.Exact, self.Ranges, self.HasRanges = set(), CIDRTrie(), False
+		for Entry in Entries:
+			try: Network = ipaddress.ip_network(Entry.strip(), strict = False)
+			except ValueError:
+				self.Exact.add(Entry.strip())
+				continue
+			if Network.num_addresses == 1: self.Exact.add(str(Network.network_address))
+			else: self.Ranges.Add(Network); self.HasRanges = True
+
+	def Contains(self, UserIP : str, Address) -> bool:
+		if UserIP in self.Exact: return True
+		return self.HasRanges and Address is not None and self.Ranges.Contains(Address)
+
+class AccessRules(): # se recompila cuando cambia routes.json
+
+	Compiled = None
+	Lock = threading.Lock()
+	Path = "database/routes.json"
+
+	def __init__(self, RoutesCFG):
+		self.Blacklist = {Route: IPSet(IPs) for Route, IPs in RoutesCFG["blacklist"].items()}
+		self.Whitelist = {Route: IPSet(IPs) for Route, IPs in RoutesCFG["whitelist"].items()}
+		self.Endpoints, self.Prefixes = {}, []
+		for EndPoint in RoutesCFG["endpoints"]:
+			Parsed = urllib.parse.urlsplit(EndPoint)
+			if Parsed.scheme and Parsed.netloc: self.Endpoints.setdefault(f"{Parsed.scheme}://{Parsed.netloc}".lower(), []).append(EndPoint)
+			else: self.Prefixes.append(EndPoint)
+		self.Endpoints = {Origin: tuple(EndPoints) for Origin, EndPoints in self.Endpoints.items()}
+		self.Prefixes = tuple(self.Prefixes)
+
+	def Current() -> "AccessRules":
+		Version = Registry.Version(AccessRules.Path)
+		Compiled = AccessRules.Compiled
+		if Compiled is not None and Compiled[0] == Version: return Compiled[1]
+		with AccessRules.Lock:
+			if AccessRules.Compiled is None or AccessRules.Compiled[0] != Version:
+				AccessRules.Compiled = (Version, AccessRules(Registry.Get(AccessRules.Path)))
+			return AccessRules.Compiled[1]
+
+	def Routes(Route : str):
+		yield "*"
+		yield Route
+		Parts = Route.rstrip("/").split("/")
+		for Index in range(len(Parts), 0, -1): yield "/".join(Parts[:Index]) + "/*"
+
+	def AllowedURL(self, URL : str) -> bool:
+		Parsed = urllib.parse.urlsplit(URL)
+		EndPoints = self.Endpoints.get(f"{Parsed.scheme}://{Parsed.netloc}".lower())
+		return (EndPoints is not None and URL.startswith(EndPoints)) or (bool(self.Prefixes) and URL.startswith(self.Prefixes))
+
+	def Check(self, Route : str, URL : str, UserIP : str):
+		# None o (status, clave del mensaje)
+		try: Address = ipaddress.ip_address(UserIP)
+		except ValueError: Address = None
+		Routes = set(AccessRules.Routes(Route))
+
+		if any(self.Blacklist[Key].Contains(UserIP, Address) for Key in Routes if Key in self.Blacklist): return (401, "api.blacklisted")
+
+		if not self.AllowedURL(URL): return (403, "api.bad_domain")
+
+		Whitelisted = [Key for Key in Routes if Key != "*" and Key in self.Whitelist]
+		if not Whitelisted: return None
+		if "*" in self.Whitelist and self.Whitelist["*"].Contains(UserIP, Address): return None
+		if any(self.Whitelist[Key].Contains(UserIP, Address) for Key in Whitelisted): return None
+		return (403, "api.not_whitelisted")
 
 class InputValidator():
 
@@ -20,9 +127,82 @@ class InputValidator():
 		if not re.match(r'^[\w!@#$%^&*()_+{}[\]:;"\'<>?,./\\|-]+$', Password): return False
 		return len(Password) <= 4096 // 8 - 2 * 64 - 2 
 
-def Captcha(CaptchaData):
-	if CaptchaData in [None, "", "undefined"]: return False
-	Config : dict = JSON.Read("config.json")	
-	CaptchaREQ = requests.post("https://www.google.com/recaptcha/api/siteverify", data = {"secret": Config["captcha"], "response": CaptchaData}).json()
-	return False if not CaptchaREQ["success"] else True
+class PasswordHasher(): # scrypt en un pool de hilos acotado; "scrypt$n$r$p$salt$hash" y los SHA-512 antiguos siguen valiendo
+
+	Executor : concurrent.futures.ThreadPoolExecutor = None
+	Lock = threading.Lock()
+	Semaphore : asyncio.Semaphore = None
+
+	def Settings() -> dict: return {"n": 16384, "r": 8, "p": 1, "workers": 4, **Registry.Get("config.json").get("hashing", {})}
+
+	def Derive(Password : str, Salt : bytes, N : int, R : int, P : int) -> bytes:
+		return hashlib.scrypt(Password.encode("utf-8"), salt = Salt, n = N, r = R, p = P, maxmem = 256 * N * R * P, dklen = 32)
+
+	def HashSync(Password : str) -> str:
+		Settings, Salt = PasswordHasher.Settings(), os.urandom(16)
+		return f"scrypt${Settings['n']}${Settings['r']}${Settings['p']}${Salt.hex()}${PasswordHasher.Derive(Password, Salt, Settings['n'], Settings['r'], Settings['p']).hex()}"
+
+	def VerifySync(Password : str, Stored : str) -> bool:
+		if not Stored: return False
+		if not Stored.startswith("scrypt$"): return hmac.compare_digest(hashlib.sha512(Password.encode("utf-8")).digest().hex(), Stored)
+		try:
+			_, N, R, P, Salt, Hash = Stored.split("$")
+			return hmac.compare_digest(PasswordHasher.Derive(Password, bytes.fromhex(Salt), int(N), int(R), int(P)).hex(), Hash)
+		except ValueError: return False
+
+	def NeedsRehash(Stored : str) -> bool:
+		Settings = PasswordHasher.Settings()
+		return not Stored.startswith(f"scrypt${Settings['n']}${Settings['r']}${Settings['p']}$")
+
+	async def Run(Function, *Args):
+		if PasswordHasher.Executor is None:
+			with PasswordHasher.Lock:
+				if PasswordHasher.Executor is None:
+					Workers = PasswordHasher.Settings()["workers"]
+					PasswordHasher.Semaphore = asyncio.Semaphore(Workers)
+					PasswordHasher.Executor = concurrent.futures.ThreadPoolExecutor(max_workers = Workers, thread_name_prefix = "hasher")
+		# el semáforo deja esperando en el loop a lo que no cabe en el pool en vez de amontonarlo en la cola del executor
+		async with PasswordHasher.Semaphore:
+			return await asyncio.get_running_loop().run_in_executor(PasswordHasher.Executor, Function, *Args)
+
+	async def Hash(Password : str) -> str: return await PasswordHasher.Run(PasswordHasher.HashSync, Password)
+
+	async def Verify(Password : str, Stored : str) -> bool: return await PasswordHasher.Run(PasswordHasher.VerifySync, Password, Stored)
+
+class CaptchaVerifier(): # cliente async compartido; las respuestas se cachean `cache_ttl` segundos y si Google no responde se aplica `fail_open`
+
+	Cache = LRUCache(Size = 10000, TTL = 120)
+	Client : httpx.AsyncClient = None
+
+	def Settings() -> dict:
+		Captcha = Registry.Get("config.json")["captcha"]
+		Defaults = {"verify_url": "https://www.google.com/recaptcha/api/siteverify", "timeout": 3.0, "cache_ttl": 120, "fail_open": False}
+		return {**Defaults, **(Captcha if isinstance(Captcha, collections.abc.Mapping) else {"secret": Captcha})}
+
+	def GetClient() -> httpx.AsyncClient:
+		if CaptchaVerifier.Client is None:
+			Timeout = CaptchaVerifier.Settings()["timeout"]
+			CaptchaVerifier.Client = httpx.AsyncClient(timeout = httpx.Timeout(Timeout, connect = Timeout), limits = httpx.Limits(max_connections = 20, max_keepalive_connections = 10))
+		return CaptchaVerifier.Client
+
+	async def Verify(CaptchaData) -> bool:
+		if CaptchaData in [None, "", "undefined"]: return False
+		Cached = CaptchaVerifier.Cache.Get(CaptchaData)
+		if Cached is not None: return Cached
+		Settings = CaptchaVerifier.Settings()
+		try:
+			CaptchaREQ = await CaptchaVerifier.GetClient().post(Settings["verify_url"], data = {"secret": Settings["secret"], "response": CaptchaData})
+			CaptchaREQ.raise_for_status()
+			Success = CaptchaREQ.json()["success"] == True
+		except (httpx.HTTPError, ValueError, KeyError) as Error:
+			print(f"Captcha verification failed ({type(Error).__name__}), fail_open = {Settings['fail_open']}")
+			return bool(Settings["fail_open"])
+		CaptchaVerifier.Cache.Set(CaptchaData, Success, TTL = Settings["cache_ttl"])
+		return Success
+
+	async def Close():
+		if CaptchaVerifier.Client is not None: await CaptchaVerifier.Client.aclose()
+		CaptchaVerifier.Client = None
+
+async def Captcha(CaptchaData): return await CaptchaVerifier.Verify(CaptchaData)
 